@@ -0,0 +1,75 @@
+"""Synthetic users and products loaded straight into a booted Stack.
+
+Rows are inserted in bulk rather than through the API so large datasets
+load quickly. The state the services would have built up themselves is
+seeded too: product-service's creators table (normally fed by the user
+events stream) and the per-user product counters in Redis.
+"""
+import random
+from dataclasses import dataclass
+from decimal import Decimal
+
+from sqlalchemy import insert, select
+from werkzeug.security import generate_password_hash
+
+PASSWORD = 'benchmark-password'
+INSERT_BATCH = 1000
+
+ADJECTIVES = ('compact', 'wireless', 'ergonomic', 'vintage', 'organic', 'heavy-duty', 'portable', 'smart',
+              'handmade', 'stainless', 'waterproof', 'foldable', 'bamboo', 'ceramic', 'leather', 'solar')
+NOUNS = ('keyboard', 'kettle', 'backpack', 'lamp', 'headphones', 'desk', 'blender', 'jacket', 'notebook',
+         'speaker', 'mug', 'tent', 'camera', 'bicycle', 'watch', 'chair', 'monitor', 'bottle')
+PHRASES = ('built to last', 'ships in two days', 'with a two-year warranty', 'in three colours',
+           'for home and office', 'made from recycled materials', 'a customer favourite')
+
+
+@dataclass
+class Dataset:
+    user_ids: list
+    user_names: list
+    product_ids: list
+    password: str = PASSWORD
+
+
+def _batches(rows):
+    for start in range(0, len(rows), INSERT_BATCH):
+        yield rows[start:start + INSERT_BATCH]
+
+
+def product_row(rng, user_ids):
+    name = f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)}"
+    return {
+        'name': name,
+        'price': Decimal(rng.randint(199, 99999)).scaleb(-2),
+        'description': f"A {name}, {rng.choice(PHRASES)}.",
+        'user_id': rng.choice(user_ids),
+    }
+
+
+def generate(stack, users, products, seed=0):
+    """Insert ``users`` users and ``products`` products and return their ids."""
+    rng = random.Random(seed)
+    # one hash for everyone: hashing is deliberately slow
+    password_hash = generate_password_hash(PASSWORD)
+    user_names = [f"bench-user-{i}" for i in range(users)]
+
+    user_service = stack.user
+    with user_service.app.app_context():
+        for batch in _batches([{'name': name, 'password': password_hash} for name in user_names]):
+            user_service.db.session.execute(insert(user_service.User), batch)
+        user_service.db.session.commit()
+        rows = user_service.db.session.execute(select(user_service.User.id, user_service.User.name)).all()
+    user_ids = [user_id for user_id, _ in rows]
+
+    product_service = stack.product
+    with product_service.app.app_context():
+        creators = [{'user_id': user_id, 'name': name} for user_id, name in rows]
+        for batch in _batches(creators):
+            product_service.db.session.execute(insert(product_service.Creator), batch)
+        for batch in _batches([product_row(rng, user_ids) for _ in range(products)]):
+            product_service.db.session.execute(insert(product_service.Product), batch)
+        product_service.db.session.commit()
+        product_ids = list(product_service.db.session.scalars(select(product_service.Product.id)))
+        product_service.reconcile_product_counts(product_service.redis_client)
+
+    return Dataset(user_ids=user_ids, user_names=user_names, product_ids=product_ids)
@@ -0,0 +1,226 @@
+"""End-to-end load test of user-service and product-service, no docker needed.
+
+Boots both services in-process (see benchmarks/stack.py), loads a
+synthetic dataset, then drives each scenario at a fixed concurrency for a
+fixed time and reports latency percentiles, throughput, errors, SQL
+statements per request and the cache hit ratio. Run from the project
+root:
+
+    pip install -r benchmarks/requirements.txt
+    python -m benchmarks.loadtest --output results.json
+    python -m benchmarks.loadtest --baseline results.json   # exits 1 on regression
+
+Pass --user-db/--product-db to run against throwaway Postgres databases
+instead of SQLite; their tables are dropped and recreated.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from benchmarks import dataset as datasets
+from benchmarks.scenarios import SCENARIOS, Client
+from benchmarks.stack import Stack, sqlite_url
+
+# relative change tolerated before a metric counts as a regression
+DEFAULT_TOLERANCE = 0.2
+# absolute error-rate increase tolerated
+ERROR_RATE_TOLERANCE = 0.01
+
+# metric -> direction in which it gets worse
+COMPARED_METRICS = {
+    'p50_ms': 'up',
+    'p95_ms': 'up',
+    'p99_ms': 'up',
+    'rps': 'down',
+    'db_queries_per_request': 'up',
+}
+
+
+def percentile_ms(ordered, quantile):
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, int(round(quantile * len(ordered))) - 1))
+    return round(ordered[index] * 1000, 2)
+
+
+def _latency_summary(latencies):
+    ordered = sorted(latencies)
+    return {
+        'p50_ms': percentile_ms(ordered, 0.50),
+        'p95_ms': percentile_ms(ordered, 0.95),
+        'p99_ms': percentile_ms(ordered, 0.99),
+        'max_ms': round(ordered[-1] * 1000, 2) if ordered else None,
+    }
+
+
+def _worker(scenario, client, stop, samples):
+    while not stop.is_set():
+        operation = scenario.pick(client.rng)
+        start = time.perf_counter()
+        try:
+            label, response = operation(client)
+            failed = response.status_code >= 500
+        except requests.RequestException:
+            label, failed = operation.__name__, True
+        samples.append((label, time.perf_counter() - start, failed))
+
+
+def _drive(stack, dataset, scenario, concurrency, seconds, seed):
+    """Run the scenario for ``seconds`` with ``concurrency`` workers; return (label, seconds, failed) samples."""
+    stop = threading.Event()
+    per_worker = [[] for _ in range(concurrency)]
+    threads = [
+        threading.Thread(target=_worker, name=f'loadtest-{i}', daemon=True,
+                         args=(scenario, Client(requests.Session(), stack, dataset, seed + i), stop, per_worker[i]))
+        for i in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return [sample for samples in per_worker for sample in samples]
+
+
+def run_scenario(stack, dataset, scenario, concurrency, duration, warmup, seed):
+    if warmup > 0:
+        _drive(stack, dataset, scenario, concurrency, warmup, seed)
+
+    queries_before = stack.queries.read()
+    hits_before, misses_before = stack.cache_lookups()
+    started = time.perf_counter()
+    samples = _drive(stack, dataset, scenario, concurrency, duration, seed + concurrency)
+    elapsed = time.perf_counter() - started
+    queries = stack.queries.read() - queries_before
+    hits_after, misses_after = stack.cache_lookups()
+    hits, misses = hits_after - hits_before, misses_after - misses_before
+
+    operations = {}
+    for label, seconds, failed in samples:
+        operations.setdefault(label, []).append((seconds, failed))
+
+    total = len(samples)
+    errors = sum(1 for _, _, failed in samples if failed)
+    return {
+        'description': scenario.description,
+        'requests': total,
+        'errors': errors,
+        'error_rate': round(errors / total, 4) if total else 0.0,
+        'rps': round(total / elapsed, 1),
+        **_latency_summary([seconds for _, seconds, _ in samples]),
+        # statements issued while serving requests, either service, per client request
+        'db_queries_per_request': round(queries / total, 2) if total else None,
+        'cache_hit_ratio': round(hits / (hits + misses), 4) if hits + misses else None,
+        'operations': {
+            label: {
+                'requests': len(results),
+                'errors': sum(1 for _, failed in results if failed),
+                **_latency_summary([seconds for seconds, _ in results]),
+            }
+            for label, results in sorted(operations.items())
+        },
+    }
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Return a list of regression messages for scenarios present in both runs."""
+    regressions = []
+    for name, current in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if previous is None:
+            continue
+        for metric, worse in COMPARED_METRICS.items():
+            before, after = previous.get(metric), current.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            if (worse == 'up' and change > tolerance) or (worse == 'down' and -change > tolerance):
+                regressions.append(f"{name}: {metric} {before} -> {after} ({change:+.0%})")
+        if current['error_rate'] - previous.get('error_rate', 0) > ERROR_RATE_TOLERANCE:
+            regressions.append(f"{name}: error_rate {previous.get('error_rate', 0)} -> {current['error_rate']}")
+    return regressions
+
+
+def print_report(results):
+    columns = ('requests', 'rps', 'p50_ms', 'p95_ms', 'p99_ms', 'error_rate', 'db_queries_per_request', 'cache_hit_ratio')
+    print(f"{'scenario':<22}" + ''.join(f"{column:>24}" for column in columns))
+    for name, scenario in results['scenarios'].items():
+        print(f"{name:<22}" + ''.join(f"{str(scenario[column]):>24}" for column in columns))
+        for label, operation in scenario['operations'].items():
+            print(f"  {label:<32} n={operation['requests']:<8} errors={operation['errors']:<6} "
+                  f"p50={operation['p50_ms']}ms p95={operation['p95_ms']}ms p99={operation['p99_ms']}ms")
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=15, help="measured seconds per scenario")
+    parser.add_argument('--warmup', type=float, default=3, help="unmeasured seconds per scenario")
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help="scenario to run (repeatable; default all)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--user-db', help="user-service database URL (default: temporary SQLite)")
+    parser.add_argument('--product-db', help="product-service database URL (default: temporary SQLite)")
+    parser.add_argument('--output', help="write results JSON here")
+    parser.add_argument('--baseline', help="results JSON to compare against; exit 1 on regression")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="relative change tolerated before failing (default %(default)s)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory(prefix='loadtest-') as workdir:
+        stack = Stack(args.user_db or sqlite_url(os.path.join(workdir, 'user.db')),
+                      args.product_db or sqlite_url(os.path.join(workdir, 'product.db'))).start()
+        try:
+            print(f"Loading {args.users} users and {args.products} products...", file=sys.stderr)
+            dataset = datasets.generate(stack, args.users, args.products, args.seed)
+            results = {
+                'config': {
+                    'users': args.users,
+                    'products': args.products,
+                    'concurrency': args.concurrency,
+                    'duration': args.duration,
+                    'database': 'sqlite' if not args.user_db else 'external',
+                    'python': platform.python_version(),
+                    'machine': platform.machine(),
+                },
+                'scenarios': {},
+            }
+            for name in args.scenario or SCENARIOS:
+                print(f"Running {name}...", file=sys.stderr)
+                results['scenarios'][name] = run_scenario(
+                    stack, dataset, SCENARIOS[name], args.concurrency, args.duration, args.warmup, args.seed)
+        finally:
+            stack.stop()
+
+    print_report(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressions against baseline:", file=sys.stderr)
+            for regression in regressions:
+                print(f"  {regression}", file=sys.stderr)
+            return 1
+        print("No regressions against baseline.", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,280 @@
+"""Microbenchmarks for the per-request Python hot path.
+
+On a cache hit most of a request's cost is not I/O but the Python around
+it. Each benchmark isolates one piece and reports the time per call
+(best and median of several timeit rounds) and, measured separately under
+tracemalloc, the peak memory allocated per call and what stays allocated
+afterwards. The pieces covered are:
+- JSON log formatting, and log calls with f-string versus lazy %-style
+  messages;
+- decoding a cached string and rendering it with jsonify;
+- Prometheus label lookups;
+- whole cache-hit requests to both services through the Flask test client.
+
+Both services run in-process on SQLite with fakeredis (benchmarks/stack.py).
+Run from the project root:
+
+    python -m benchmarks.micro                       # compare with the stored baseline
+    python -m benchmarks.micro --save-baseline       # after an intended change
+    python -m benchmarks.micro -k log_ --no-compare
+
+Timings depend on the machine and Python version. Refresh the baseline
+on the machine that does the comparing; allocations are steadier.
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+from flask import jsonify
+from prometheus_client import CollectorRegistry, Counter, Histogram
+
+from benchmarks import dataset as datasets
+from benchmarks.stack import Stack, sqlite_url
+from common.log_pipeline import JSONFormatter
+from common.log_sampling import SamplingFilter
+from common.request_metrics import REQUEST_BUCKETS
+from common.tracing import LogContextFilter
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'micro.json')
+
+# relative slowdown / allocation growth tolerated by --compare
+TIME_TOLERANCE = 0.25
+ALLOC_TOLERANCE = 0.10
+# allocation changes smaller than this many bytes are noise
+ALLOC_FLOOR_BYTES = 256
+
+ROUNDS = 5
+ALLOC_CALLS = 200
+
+
+def _product_payload(product_id=1):
+    return {
+        "id": product_id,
+        "name": "ergonomic keyboard",
+        "price": 129.99,
+        "description": "A ergonomic keyboard, ships in two days.",
+        "user_id": 42,
+        "creator": "bench-user-42",
+    }
+
+
+def log_benchmarks():
+    formatter = JSONFormatter('bench_service')
+    record = logging.LogRecord('bench_service', logging.INFO, __file__, 1,
+                               "Get product request for product_id: %s", (1234,), None, func='get_product')
+    record.endpoint = '/product/<int:product_id>'
+    record.product_id = 1234
+    record.status_code = 200
+    record.trace_id = '4bf92f3577b34da6a3ce929d0e0e4736'
+    record.span_id = '00f067aa0ba902b7'
+
+    # INFO disabled, as for sampled-out or LOG_LEVEL=WARNING services
+    disabled = logging.getLogger('bench.disabled')
+    disabled.propagate = False
+    disabled.setLevel(logging.WARNING)
+
+    # the full synchronous path: both filters, formatter, stream write
+    enabled = logging.getLogger('bench.enabled')
+    enabled.propagate = False
+    enabled.setLevel(logging.INFO)
+    enabled.addFilter(SamplingFilter(default_rate=1.0, rates={}, muted=()))
+    enabled.addFilter(LogContextFilter())
+    handler = logging.StreamHandler(io.StringIO())
+    handler.setFormatter(formatter)
+    enabled.addHandler(handler)
+
+    def reset_stream():
+        handler.stream.seek(0)
+        handler.stream.truncate()
+
+    product_id = 1234
+    extra = {'endpoint': '/product/<int:product_id>', 'product_id': product_id}
+
+    def enabled_lazy():
+        enabled.info("Get product request for product_id: %s", product_id, extra=extra)
+        reset_stream()
+
+    return {
+        'log_json_format': lambda: formatter.format(record),
+        'log_disabled_fstring': lambda: disabled.info(f"Get product request for product_id: {product_id}", extra=extra),
+        'log_disabled_lazy': lambda: disabled.info("Get product request for product_id: %s", product_id, extra=extra),
+        'log_enabled_lazy_sync': enabled_lazy,
+    }
+
+
+def serialization_benchmarks(stack):
+    raw = json.dumps(_product_payload())
+    raw_page = json.dumps([_product_payload(i) for i in range(20)])
+    app = stack.product.app
+
+    def cached_product():
+        with app.app_context():
+            return jsonify({"product": json.loads(raw), "cached": True})
+
+    def cached_page():
+        with app.app_context():
+            return jsonify({"products": json.loads(raw_page), "next_cursor": None, "limit": 20, "cached": True})
+
+    return {
+        'json_loads_product': lambda: json.loads(raw),
+        'cached_product_jsonify': cached_product,
+        'cached_page_jsonify': cached_page,
+    }
+
+
+def metrics_benchmarks():
+    # a private registry, shaped like RequestMetrics, keeps these out of /metrics
+    registry = CollectorRegistry()
+    requests_total = Counter('bench_requests_total', 'Total requests', ['method', 'endpoint', 'status'], registry=registry)
+    duration = Histogram('bench_request_duration_seconds', 'Request duration', ['method', 'endpoint', 'status'],
+                         buckets=REQUEST_BUCKETS, registry=registry)
+    child = requests_total.labels('GET', '/product/<int:product_id>', '200')
+    return {
+        'counter_labels_inc': lambda: requests_total.labels('GET', '/product/<int:product_id>', '200').inc(),
+        'counter_child_inc': child.inc,
+        'histogram_labels_observe': lambda: duration.labels('GET', '/product/<int:product_id>', '200').observe(0.004),
+    }
+
+
+def request_benchmarks(stack, dataset):
+    product_client = stack.product.app.test_client()
+    user_client = stack.user.app.test_client()
+    product_id = dataset.product_ids[0]
+    user_id = dataset.user_ids[0]
+
+    def get(client, path):
+        def call():
+            response = client.get(path)
+            assert response.status_code == 200, (path, response.status_code)
+        # fill both cache tiers before measuring
+        call()
+        return call
+
+    return {
+        'request_product_cache_hit': get(product_client, f'/product/{product_id}'),
+        'request_products_page_cache_hit': get(product_client, '/products?limit=20'),
+        'request_product_count': get(product_client, f'/products/count?user_id={user_id}'),
+        'request_user_cache_hit': get(user_client, f'/user/{user_id}'),
+        'request_user_health': get(user_client, '/health'),
+    }
+
+
+def measure(fn):
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    per_call = [total / number for total in timer.repeat(ROUNDS, number)]
+
+    fn()
+    tracemalloc.start()
+    try:
+        # preallocated so the bookkeeping itself doesn't show up as retained
+        peaks = [0] * ALLOC_CALLS
+        retained = 0
+        for i in range(ALLOC_CALLS):
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            fn()
+            current, peak = tracemalloc.get_traced_memory()
+            peaks[i] = peak - before
+            retained += current - before
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'best_us': round(min(per_call) * 1e6, 3),
+        'median_us': round(statistics.median(per_call) * 1e6, 3),
+        'calls_per_round': number,
+        'peak_alloc_bytes': int(statistics.median(peaks)),
+        'retained_bytes_per_call': round(retained / ALLOC_CALLS, 1),
+    }
+
+
+def compare(results, baseline):
+    """Return regression messages for benchmarks present in both runs."""
+    regressions = []
+    for name, current in results['benchmarks'].items():
+        previous = baseline.get('benchmarks', {}).get(name)
+        if previous is None:
+            continue
+        if current['median_us'] > previous['median_us'] * (1 + TIME_TOLERANCE):
+            regressions.append(f"{name}: median {previous['median_us']}us -> {current['median_us']}us")
+        growth = current['peak_alloc_bytes'] - previous['peak_alloc_bytes']
+        if growth > ALLOC_FLOOR_BYTES and growth > previous['peak_alloc_bytes'] * ALLOC_TOLERANCE:
+            regressions.append(f"{name}: peak allocation {previous['peak_alloc_bytes']}B -> {current['peak_alloc_bytes']}B")
+    return regressions
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-k', dest='pattern', help="only run benchmarks whose name contains this")
+    parser.add_argument('--baseline', default=BASELINE_PATH, help="baseline JSON (default: %(default)s)")
+    parser.add_argument('--save-baseline', action='store_true', help="write the results to --baseline")
+    parser.add_argument('--no-compare', action='store_true', help="don't compare with the baseline")
+    parser.add_argument('--output', help="also write results JSON here")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory(prefix='micro-') as workdir:
+        stack = Stack(sqlite_url(os.path.join(workdir, 'user.db')), sqlite_url(os.path.join(workdir, 'product.db'))).start()
+        try:
+            dataset = datasets.generate(stack, users=100, products=1000)
+            benchmarks = {
+                **log_benchmarks(),
+                **serialization_benchmarks(stack),
+                **metrics_benchmarks(),
+                **request_benchmarks(stack, dataset),
+            }
+            results = {
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'benchmarks': {},
+            }
+            for name, fn in benchmarks.items():
+                if args.pattern and args.pattern not in name:
+                    continue
+                results['benchmarks'][name] = result = measure(fn)
+                print(f"{name:<36} median {result['median_us']:>10.3f}us  best {result['best_us']:>10.3f}us  "
+                      f"peak {result['peak_alloc_bytes']:>8}B  retained {result['retained_bytes_per_call']:>8}B")
+        finally:
+            stack.stop()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+        print(f"Baseline written to {args.baseline}", file=sys.stderr)
+        return 0
+    if args.no_compare or not os.path.exists(args.baseline):
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get('python') != results['python']:
+        print(f"Baseline was recorded on Python {baseline.get('python')}; timings may not be comparable",
+              file=sys.stderr)
+    regressions = compare(results, baseline)
+    if regressions:
+        print("Regressions against baseline:", file=sys.stderr)
+        for regression in regressions:
+            print(f"  {regression}", file=sys.stderr)
+        return 1
+    print("No regressions against baseline.", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""Traffic mixes the load test can drive.
+
+A scenario is a weighted set of operations. Each operation makes one HTTP
+call through a per-worker ``Client`` and returns a short label for the
+per-operation breakdown. Reads are skewed towards a hot set (HOT_SHARE of
+reads go to the first HOT_FRACTION of ids), as real catalogue traffic is.
+"""
+import random
+
+from benchmarks.dataset import product_row
+
+HOT_FRACTION = 0.2
+HOT_SHARE = 0.8
+
+
+class Client:
+    """One load-test worker: an HTTP session plus its own RNG and cursor state."""
+
+    def __init__(self, session, stack, dataset, seed):
+        self.session = session
+        self.user_url = stack.user_url
+        self.product_url = stack.product_url
+        self.dataset = dataset
+        self.rng = random.Random(seed)
+        self.next_cursor = None
+
+    def skewed(self, items):
+        hot = max(1, int(len(items) * HOT_FRACTION))
+        if self.rng.random() < HOT_SHARE:
+            return items[self.rng.randrange(hot)]
+        return self.rng.choice(items)
+
+
+def list_products(client):
+    # follow the previous page's cursor now and then, otherwise start over
+    params = {'limit': 20}
+    if client.next_cursor and client.rng.random() < 0.3:
+        params['cursor'] = client.next_cursor
+    elif client.rng.random() < 0.3:
+        params['sort'] = client.rng.choice(('price', '-price', '-id'))
+    response = client.session.get(f"{client.product_url}/products", params=params)
+    if response.status_code == 200 and 'sort' not in params:
+        client.next_cursor = response.json().get('next_cursor')
+    return 'GET /products', response
+
+
+def get_product(client):
+    product_id = client.skewed(client.dataset.product_ids)
+    return 'GET /product/<id>', client.session.get(f"{client.product_url}/product/{product_id}")
+
+
+def get_user(client):
+    user_id = client.skewed(client.dataset.user_ids)
+    return 'GET /user/<id>', client.session.get(f"{client.user_url}/user/{user_id}")
+
+
+def count_products(client):
+    user_id = client.skewed(client.dataset.user_ids)
+    return 'GET /products/count', client.session.get(f"{client.product_url}/products/count", params={'user_id': user_id})
+
+
+def create_product(client):
+    row = product_row(client.rng, client.dataset.user_ids)
+    row['price'] = str(row['price'])
+    return 'POST /products', client.session.post(f"{client.product_url}/products", json=row)
+
+
+def update_product(client):
+    product_id = client.rng.choice(client.dataset.product_ids)
+    body = {'price': f"{client.rng.randint(199, 99999) / 100:.2f}"}
+    return 'PUT /products/<id>', client.session.put(f"{client.product_url}/products/{product_id}", json=body)
+
+
+def login(client):
+    name = client.rng.choice(client.dataset.user_names)
+    return 'POST /login', client.session.post(f"{client.user_url}/login", json={'name': name, 'password': client.dataset.password})
+
+
+def failed_login(client):
+    name = client.rng.choice(client.dataset.user_names)
+    return 'POST /login (bad password)', client.session.post(f"{client.user_url}/login", json={'name': name, 'password': 'wrong'})
+
+
+class Scenario:
+    def __init__(self, name, description, operations):
+        self.name = name
+        self.description = description
+        self._operations = [operation for operation, _ in operations]
+        self._weights = [weight for _, weight in operations]
+
+    def pick(self, rng):
+        return rng.choices(self._operations, self._weights)[0]
+
+
+SCENARIOS = {scenario.name: scenario for scenario in (
+    Scenario('read_heavy_list', "Paging through /products with some product detail reads",
+             [(list_products, 80), (get_product, 20)]),
+    Scenario('single_product_reads', "Product and user detail reads on a hot set",
+             [(get_product, 70), (get_user, 20), (count_products, 10)]),
+    Scenario('write_burst', "Product creates and price updates with reads in between",
+             [(create_product, 50), (update_product, 30), (list_products, 20)]),
+    Scenario('login_storm', "Logins, a tenth of them with a wrong password",
+             [(login, 90), (failed_login, 10)]),
+)}
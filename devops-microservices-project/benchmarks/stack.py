@@ -0,0 +1,206 @@
+"""Both services booted in one process against local stand-ins.
+
+Each service gets its own database: SQLite files by default, or any
+SQLAlchemy URL (e.g. a throwaway local Postgres). Both services share one
+in-memory fakeredis server, so pub/sub invalidation, the user events
+stream and the product counters behave as they do in docker-compose. Each
+app is served by a threaded werkzeug server on a free localhost port, and
+product-service calls user-service over real HTTP.
+
+Everything runs in the benchmark's own process and shares its GIL, so the
+numbers are for comparing runs on the same machine, not for capacity
+planning.
+"""
+import importlib
+import logging
+import os
+import sqlite3
+import sys
+import threading
+
+import fakeredis
+from flask import has_request_context
+from prometheus_client import REGISTRY
+from sqlalchemy import event
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.compiler import compiles
+from werkzeug.serving import make_server
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+# both services' clients resolve to the same fakeredis server through this host
+REDIS_HOST = 'benchmark-redis'
+
+# quiet defaults for the services; anything already in the environment wins.
+# Set before any common module is imported, as they read it at import time.
+SERVICE_ENV = {
+    'REDIS_HOST': REDIS_HOST,
+    'LOG_LEVEL': 'ERROR',
+    'LOG_SUMMARY_INTERVAL': '0',
+    'TRACE_EXPORTER': 'none',
+}
+for _key, _value in SERVICE_ENV.items():
+    os.environ.setdefault(_key, _value)
+
+from common import request_metrics  # noqa: E402
+
+
+class FakeTimedRedisConnection(request_metrics.TimedRedisConnection, fakeredis.FakeConnection):
+    """fakeredis connection that still adds to the request's Redis time."""
+
+
+@compiles(TSVECTOR, 'sqlite')
+def _compile_tsvector(type_, compiler, **kw):
+    return 'TEXT'
+
+
+@event.listens_for(Engine, 'connect')
+def _prepare_sqlite(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    # enough of Postgres text search for products.search_vector to compute
+    dbapi_connection.create_function('to_tsvector', 2, lambda config, text: (text or '').lower(), deterministic=True)
+    dbapi_connection.create_function('setweight', 2, lambda vector, weight: vector, deterministic=True)
+    cursor = dbapi_connection.cursor()
+    # readers don't block the writer, as in Postgres
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.close()
+
+
+def sqlite_url(path):
+    # wait on the write lock instead of failing under concurrent writes
+    return f'sqlite:///{os.path.abspath(path)}?timeout=30'
+
+
+def _import_service(directory, env):
+    """Import a service's app module with its own directory on sys.path.
+
+    Both services have top-level ``app`` and ``model`` modules, so this
+    service's modules are dropped from sys.modules afterwards; the
+    returned module keeps its own references to them.
+    """
+    os.environ.update(env)
+    path = os.path.join(PROJECT_ROOT, directory)
+    sys.path.insert(0, path)
+    try:
+        return importlib.import_module('app')
+    finally:
+        sys.path.remove(path)
+        for name, module in list(sys.modules.items()):
+            filename = getattr(module, '__file__', None)
+            if filename and os.path.dirname(os.path.abspath(filename)) == path:
+                del sys.modules[name]
+
+
+def _create_schema(service, url):
+    with service.app.app_context():
+        service.db.drop_all()
+        if url.startswith('sqlite'):
+            service.db.create_all()
+        else:
+            service.init_db()
+
+
+class _ServiceServer:
+    def __init__(self, name, app):
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        self._thread = threading.Thread(target=self.server.serve_forever, name=f'{name}-server', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+
+
+class QueryCounter:
+    """Counts SQL statements run while handling a request, across the given engines."""
+
+    def __init__(self, engines):
+        self._count = 0
+        self._lock = threading.Lock()
+        for engine in engines:
+            event.listen(engine, 'after_cursor_execute', self._after_execute)
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if has_request_context():
+            with self._lock:
+                self._count += 1
+
+    def read(self):
+        with self._lock:
+            return self._count
+
+
+class Stack:
+    """user-service and product-service running in this process."""
+
+    def __init__(self, user_db, product_db):
+        self.user_db = user_db
+        self.product_db = product_db
+        self.user = None
+        self.product = None
+        self.queries = None
+        self._servers = []
+
+    def start(self):
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        original_connection = request_metrics.TimedRedisConnection
+        request_metrics.TimedRedisConnection = FakeTimedRedisConnection
+        try:
+            self.user = _import_service('user-service', {'DATABASE_URL': self.user_db})
+            user_server = self._serve('user_service', self.user)
+            self.product = _import_service('product-service', {
+                'DATABASE_URL': self.product_db, 'USER_SERVICE_URL': user_server.url})
+            self._serve('product_service', self.product)
+        finally:
+            request_metrics.TimedRedisConnection = original_connection
+
+        _create_schema(self.user, self.user_db)
+        _create_schema(self.product, self.product_db)
+        self.user.redis_client.flushall()
+        self.user.start_background_workers()
+        self.product.start_background_workers()
+        self.queries = QueryCounter([self._engine(self.user), self._engine(self.product)])
+        return self
+
+    @staticmethod
+    def _engine(service):
+        with service.app.app_context():
+            return service.db.engine
+
+    def _serve(self, name, service):
+        server = _ServiceServer(name, service.app)
+        server.start()
+        self._servers.append(server)
+        return server
+
+    @property
+    def user_url(self):
+        return self._servers[0].url
+
+    @property
+    def product_url(self):
+        return self._servers[1].url
+
+    def cache_lookups(self):
+        """Total (hits, misses) over both services' cache lookup counters."""
+        names = {'user_service_cache_lookups', 'product_service_cache_lookups'}
+        totals = {'hit': 0.0, 'miss': 0.0}
+        for metric in REGISTRY.collect():
+            if metric.name in names:
+                for sample in metric.samples:
+                    if sample.name.endswith('_total') and sample.labels.get('result') in totals:
+                        totals[sample.labels['result']] += sample.value
+        return totals['hit'], totals['miss']
+
+    def stop(self):
+        for server in self._servers:
+            server.stop()
+        self.user.worker_exit()
+        self.product.worker_exit()
@@ -0,0 +1,397 @@
+"""Two-tier cache: a bounded in-process LRU (L1) in front of Redis (L2).
+
+L1 holds decoded JSON values, so a hit skips both the Redis round trip and
+json.loads. Entries are bounded by count, by approximate size (length of
+the serialized value) and by a short TTL. Writers call ``invalidate``, which
+deletes the Redis keys and publishes them on a pub/sub channel; every
+process runs a listener thread that drops those keys from its L1.
+
+``get_or_compute`` adds stampede protection on top: a miss is rebuilt by
+exactly one worker holding a short Redis lock while the others poll for its
+result, and entries are written with a stale grace period after their
+fresh TTL, during which readers get the old value while one worker
+refreshes it in the background.
+
+Values returned from L1 are shared between requests and must not be
+mutated by callers.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from collections import Counter as Tally, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import g, has_request_context
+from prometheus_client import Counter, Gauge
+
+DEFAULT_L1_MAX_ENTRIES = int(os.environ.get('CACHE_L1_MAX_ENTRIES', 10000))
+DEFAULT_L1_MAX_BYTES = int(os.environ.get('CACHE_L1_MAX_BYTES', 32 * 1024 * 1024))
+DEFAULT_L1_TTL = float(os.environ.get('CACHE_L1_TTL', 10))
+INVALIDATION_CHANNEL = os.environ.get('CACHE_INVALIDATION_CHANNEL', 'cache:invalidate')
+DEFAULT_STALE_TTL = int(os.environ.get('CACHE_STALE_TTL', 30))
+DEFAULT_LOCK_TIMEOUT = float(os.environ.get('CACHE_LOCK_TIMEOUT', 5))
+DEFAULT_LOCK_WAIT = float(os.environ.get('CACHE_LOCK_WAIT', 1))
+# stale keys queued or being refreshed at once; further stale reads don't queue
+MAX_PENDING_REFRESHES = int(os.environ.get('CACHE_MAX_PENDING_REFRESHES', 64))
+LOCK_POLL_INTERVAL = 0.025
+
+# delete the lock only if we still own it
+_RELEASE_LOCK = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def key_family(key):
+    """Group a cache key for metrics: 'product:7' -> 'product:*', 'products:count:user:7' -> 'products:count:*'."""
+    parts = key.split(':')
+    if len(parts) > 2 and not parts[1].isdigit():
+        return f"{parts[0]}:{parts[1]}:*"
+    return f"{parts[0]}:*"
+
+
+class CacheMetrics:
+    def __init__(self, prefix):
+        self.requests = Counter(
+            f'{prefix}_cache_requests_total', 'Cache lookups', ['tier', 'result'])
+        self.evictions = Counter(
+            f'{prefix}_cache_evictions_total', 'L1 cache evictions', ['reason'])
+        self.l1_entries = Gauge(
+            f'{prefix}_cache_l1_entries', 'Entries held in the in-process cache',
+            multiprocess_mode='livesum')
+        self.l1_bytes = Gauge(
+            f'{prefix}_cache_l1_bytes', 'Approximate size of the in-process cache',
+            multiprocess_mode='livesum')
+        self.rebuilds = Counter(
+            f'{prefix}_cache_rebuilds_total', 'Cache rebuilds by single-flight role',
+            ['role'])
+        self.lookups = Counter(
+            f'{prefix}_cache_lookups_total', 'Cache lookups by key family, either tier',
+            ['family', 'result'])
+
+
+class LocalCache:
+    """Thread-safe LRU with per-entry expiry and a size budget."""
+
+    def __init__(self, metrics, max_entries=DEFAULT_L1_MAX_ENTRIES, max_bytes=DEFAULT_L1_MAX_BYTES):
+        self.metrics = metrics
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                self._remove(key)
+                self.metrics.evictions.labels('expired').inc()
+                return None
+            self._entries.move_to_end(key)
+            return entry[2]
+
+    def set(self, key, value, size, ttl):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + ttl, size, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.metrics.evictions.labels('capacity').inc()
+            self._update_gauges()
+
+    def delete(self, keys):
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._remove(key)
+                    self.metrics.evictions.labels('invalidated').inc()
+            self._update_gauges()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._update_gauges()
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def _update_gauges(self):
+        self.metrics.l1_entries.set(len(self._entries))
+        self.metrics.l1_bytes.set(self._bytes)
+
+
+class TieredCache:
+    """JSON cache over an L1 LocalCache and a Redis client (decode_responses=True)."""
+
+    def __init__(self, redis_client, metrics, logger=None, l1_ttl=DEFAULT_L1_TTL,
+                 channel=INVALIDATION_CHANNEL, local=None, lock_timeout=DEFAULT_LOCK_TIMEOUT,
+                 lock_wait=DEFAULT_LOCK_WAIT):
+        self.redis = redis_client
+        self.metrics = metrics
+        self.logger = logger
+        self.l1_ttl = l1_ttl
+        self.channel = channel
+        self.local = local or LocalCache(metrics)
+        self.lock_timeout = lock_timeout
+        self.lock_wait = lock_wait
+        self._release_lock = redis_client.register_script(_RELEASE_LOCK)
+        self._refresher = ThreadPoolExecutor(max_workers=2, thread_name_prefix='cache-refresh')
+        # keys queued or being refreshed by this process
+        self._refreshing = set()
+        self._refreshing_lock = threading.Lock()
+        self._listener = None
+
+    def get(self, key):
+        """Return the decoded value for key, or None on a miss in both tiers."""
+        value = self.local.get(key)
+        if value is not None:
+            self.metrics.requests.labels('l1', 'hit').inc()
+            self.record_lookups(hits=[key])
+            return value
+        self.metrics.requests.labels('l1', 'miss').inc()
+
+        # fetch the TTL in the same round trip so L1 never outlives Redis
+        raw, remaining = self.redis.pipeline(transaction=False).get(key).ttl(key).execute()
+        if raw is None:
+            self.metrics.requests.labels('redis', 'miss').inc()
+            self.record_lookups(misses=[key])
+            return None
+        self.metrics.requests.labels('redis', 'hit').inc()
+        self.record_lookups(hits=[key])
+        value = json.loads(raw)
+        l1_ttl = self.l1_ttl if remaining is None or remaining < 0 else min(self.l1_ttl, remaining)
+        self.local.set(key, value, len(raw), l1_ttl)
+        return value
+
+    def get_many(self, keys):
+        """Return {key: value} for every key found in L1 or Redis (one MGET for L1 misses)."""
+        found = {}
+        missing = []
+        for key in keys:
+            value = self.local.get(key)
+            if value is None:
+                missing.append(key)
+            else:
+                found[key] = value
+        self.metrics.requests.labels('l1', 'hit').inc(len(found))
+        self.metrics.requests.labels('l1', 'miss').inc(len(missing))
+        if not missing:
+            self.record_lookups(hits=found)
+            return found
+
+        hits = 0
+        for key, raw in zip(missing, self.redis.mget(missing)):
+            if raw is not None:
+                value = json.loads(raw)
+                found[key] = value
+                self.local.set(key, value, len(raw), self.l1_ttl)
+                hits += 1
+        self.metrics.requests.labels('redis', 'hit').inc(hits)
+        self.metrics.requests.labels('redis', 'miss').inc(len(missing) - hits)
+        self.record_lookups(hits=found, misses=[key for key in missing if key not in found])
+        return found
+
+    def record_lookups(self, hits=(), misses=()):
+        """Count lookup outcomes per key family, and on the current request for the request summary.
+
+        Public so callers reading Redis directly can report their lookups too.
+        """
+        for result, keys in (('hit', hits), ('miss', misses)):
+            for family, count in Tally(key_family(key) for key in keys).items():
+                self.metrics.lookups.labels(family, result).inc(count)
+        if has_request_context():
+            g.cache_hits = g.get('cache_hits', 0) + len(hits)
+            g.cache_misses = g.get('cache_misses', 0) + len(misses)
+
+    def set_many(self, items, ttl):
+        """Store every {key: value} pair in one pipeline."""
+        pipe = self.redis.pipeline(transaction=False)
+        for key, value in items.items():
+            raw = json.dumps(value)
+            pipe.setex(key, ttl, raw)
+            self.local.set(key, value, len(raw), min(self.l1_ttl, ttl))
+        pipe.execute()
+
+    def set(self, key, value, ttl, stale_ttl=0):
+        """Store value as fresh for ttl seconds, then servable-but-stale for stale_ttl more."""
+        raw = json.dumps(value)
+        self.redis.setex(key, ttl + stale_ttl, raw)
+        self.local.set(key, value, len(raw), min(self.l1_ttl, ttl))
+
+    def get_or_compute(self, key, compute, ttl, stale_ttl=DEFAULT_STALE_TTL):
+        """Return (value, cached), calling compute() at most once across workers on a miss.
+
+        compute runs without a request context when refreshing in the
+        background, so it must set up whatever context it needs. A None
+        result is returned but not cached.
+        """
+        value = self.local.get(key)
+        if value is not None:
+            self.metrics.requests.labels('l1', 'hit').inc()
+            self.record_lookups(hits=[key])
+            return value, True
+        self.metrics.requests.labels('l1', 'miss').inc()
+
+        raw, remaining = self.redis.pipeline(transaction=False).get(key).ttl(key).execute()
+        if raw is not None:
+            value = json.loads(raw)
+            if remaining is not None and 0 <= remaining <= stale_ttl:
+                # past its fresh TTL: serve it and let one worker refresh it
+                self.metrics.requests.labels('redis', 'stale').inc()
+                self._schedule_refresh(key, compute, ttl, stale_ttl)
+            else:
+                self.metrics.requests.labels('redis', 'hit').inc()
+                fresh_for = self.l1_ttl if remaining is None or remaining < 0 else remaining - stale_ttl
+                self.local.set(key, value, len(raw), min(self.l1_ttl, fresh_for))
+            self.record_lookups(hits=[key])
+            return value, True
+        self.metrics.requests.labels('redis', 'miss').inc()
+        self.record_lookups(misses=[key])
+
+        lock_key, token = f"lock:{key}", uuid.uuid4().hex
+        if self.redis.set(lock_key, token, nx=True, px=int(self.lock_timeout * 1000)):
+            self.metrics.rebuilds.labels('leader').inc()
+            try:
+                return self._compute_and_store(key, compute, ttl, stale_ttl), False
+            finally:
+                self._release_lock(keys=[lock_key], args=[token])
+
+        # another worker is rebuilding this key: wait briefly for its result
+        self.metrics.rebuilds.labels('follower').inc()
+        give_up_at = time.monotonic() + self.lock_wait
+        while time.monotonic() < give_up_at:
+            time.sleep(LOCK_POLL_INTERVAL)
+            raw, locked = self.redis.pipeline(transaction=False).get(key).exists(lock_key).execute()
+            if raw is not None:
+                return json.loads(raw), True
+            if not locked:
+                # the leader finished without caching anything (a None
+                # result or an error): no point waiting out lock_wait
+                break
+        else:
+            self.metrics.rebuilds.labels('timeout').inc()
+        return self._compute_and_store(key, compute, ttl, stale_ttl), False
+
+    def _compute_and_store(self, key, compute, ttl, stale_ttl):
+        value = compute()
+        if value is not None:
+            self.set(key, value, ttl, stale_ttl)
+        return value
+
+    def _schedule_refresh(self, key, compute, ttl, stale_ttl):
+        with self._refreshing_lock:
+            if key in self._refreshing:
+                return
+            if len(self._refreshing) >= MAX_PENDING_REFRESHES:
+                # the next stale read after the backlog drains queues it again
+                self.metrics.rebuilds.labels('refresh_dropped').inc()
+                return
+            self._refreshing.add(key)
+        try:
+            self._refresher.submit(self._refresh, key, compute, ttl, stale_ttl)
+        except Exception:
+            with self._refreshing_lock:
+                self._refreshing.discard(key)
+            raise
+
+    def _refresh(self, key, compute, ttl, stale_ttl):
+        lock_key, token = f"lock:{key}", uuid.uuid4().hex
+        try:
+            if not self.redis.set(lock_key, token, nx=True, px=int(self.lock_timeout * 1000)):
+                return
+            try:
+                # another worker may have refreshed it since the stale read
+                if self.redis.ttl(key) > stale_ttl:
+                    return
+                self.metrics.rebuilds.labels('refresh').inc()
+                self._compute_and_store(key, compute, ttl, stale_ttl)
+            finally:
+                self._release_lock(keys=[lock_key], args=[token])
+        except Exception as e:
+            if self.logger:
+                self.logger.warning("Background cache refresh failed", extra={'endpoint': 'cache', 'cache_key': key, 'error': str(e)})
+        finally:
+            with self._refreshing_lock:
+                self._refreshing.discard(key)
+
+    def replace(self, key, value, ttl, pipe=None):
+        """Write value through to Redis and tell other processes to drop their L1 copy.
+
+        When ``pipe`` is given the commands are queued on it and the caller
+        executes it.
+        """
+        raw = json.dumps(value)
+        self.local.set(key, value, len(raw), min(self.l1_ttl, ttl))
+        execute = pipe is None
+        if pipe is None:
+            pipe = self.redis.pipeline(transaction=False)
+        pipe.setex(key, ttl, raw)
+        pipe.publish(self.channel, json.dumps([key]))
+        if execute:
+            pipe.execute()
+
+    def invalidate(self, keys, pipe=None):
+        """Delete keys from Redis and tell every process to drop them from L1.
+
+        When ``pipe`` is given the DEL and PUBLISH are queued on it and the
+        caller executes it.
+        """
+        keys = list(keys)
+        if not keys:
+            return
+        self.local.delete(keys)
+        execute = pipe is None
+        if pipe is None:
+            pipe = self.redis.pipeline(transaction=False)
+        for i in range(0, len(keys), 1000):
+            pipe.delete(*keys[i:i + 1000])
+        pipe.publish(self.channel, json.dumps(keys))
+        if execute:
+            pipe.execute()
+
+    def notify(self, keys, pipe):
+        """Queue an L1 drop for keys whose Redis value the caller changes in place on pipe."""
+        keys = list(keys)
+        if not keys:
+            return
+        self.local.delete(keys)
+        pipe.publish(self.channel, json.dumps(keys))
+
+    def start_listener(self):
+        """Start (or restart, e.g. after fork) the invalidation listener thread."""
+        self._listener = threading.Thread(target=self._listen, name='cache-invalidation', daemon=True)
+        self._listener.start()
+
+    def _listen(self):
+        while True:
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self.channel)
+                # anything published while we were disconnected is lost
+                self.local.clear()
+                for message in pubsub.listen():
+                    if message.get('type') == 'message':
+                        self.local.delete(json.loads(message['data']))
+            except Exception as e:
+                if self.logger:
+                    self.logger.warning("Cache invalidation listener disconnected", extra={'endpoint': 'cache', 'error': str(e)})
+                time.sleep(1)
+            finally:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
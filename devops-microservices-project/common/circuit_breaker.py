@@ -0,0 +1,93 @@
+"""Per-upstream circuit breaker.
+
+Closed: calls flow and outcomes are recorded in a sliding window. Once the
+window holds at least ``min_calls`` outcomes and the failure rate reaches
+``failure_rate``, the breaker opens.
+Open: calls fail fast with CircuitOpenError for ``open_seconds``.
+Half-open: up to ``half_open_calls`` probe calls are let through; a success
+closes the breaker, a failure opens it again.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+DEFAULT_FAILURE_RATE = float(os.environ.get('UPSTREAM_BREAKER_FAILURE_RATE', 0.5))
+DEFAULT_WINDOW = int(os.environ.get('UPSTREAM_BREAKER_WINDOW', 20))
+DEFAULT_MIN_CALLS = int(os.environ.get('UPSTREAM_BREAKER_MIN_CALLS', 10))
+DEFAULT_OPEN_SECONDS = float(os.environ.get('UPSTREAM_BREAKER_OPEN_SECONDS', 10))
+DEFAULT_HALF_OPEN_CALLS = int(os.environ.get('UPSTREAM_BREAKER_HALF_OPEN_CALLS', 1))
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose breaker is open."""
+
+
+class CircuitBreaker:
+    def __init__(self, failure_rate=DEFAULT_FAILURE_RATE, window=DEFAULT_WINDOW,
+                 min_calls=DEFAULT_MIN_CALLS, open_seconds=DEFAULT_OPEN_SECONDS,
+                 half_open_calls=DEFAULT_HALF_OPEN_CALLS, on_state_change=None):
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.on_state_change = on_state_change
+        self._outcomes = deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def allow(self):
+        """Return True if a call may go out now; reserves a probe slot when half-open."""
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and self._probes < self.half_open_calls:
+                self._probes += 1
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._current_state() == HALF_OPEN:
+                self._transition(CLOSED)
+                return
+            self._outcomes.append(True)
+
+    def record_failure(self):
+        with self._lock:
+            state = self._current_state()
+            if state == HALF_OPEN:
+                self._transition(OPEN)
+                return
+            if state == OPEN:
+                return
+            self._outcomes.append(False)
+            if len(self._outcomes) >= self.min_calls:
+                failures = self._outcomes.count(False)
+                if failures / len(self._outcomes) >= self.failure_rate:
+                    self._transition(OPEN)
+
+    def _current_state(self):
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._transition(HALF_OPEN)
+        return self._state
+
+    def _transition(self, state):
+        self._state = state
+        self._outcomes.clear()
+        self._probes = 0
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        if self.on_state_change:
+            self.on_state_change(state)
@@ -0,0 +1,106 @@
+"""SQLAlchemy connection pool settings and pool metrics.
+
+Pool sizing comes from the environment so it can be tuned against
+postgres.conf's max_connections (shared by both services and all their
+workers):
+
+    DB_POOL_SIZE        persistent connections per process (default 5)
+    DB_MAX_OVERFLOW     extra connections allowed under burst (default 5)
+    DB_POOL_TIMEOUT     seconds to wait for a free connection (default 10)
+    DB_POOL_RECYCLE     seconds before a connection is replaced (default 1800)
+    DB_POOL_PRE_PING    test connections on checkout (default true)
+    DB_POOL_MODE        'queue' (default) or 'pgbouncer'
+
+In 'pgbouncer' mode PgBouncer does the pooling in transaction mode, so the
+app opens a connection per checkout (NullPool) and keeps nothing between
+transactions. psycopg2 does not use server-side prepared statements and
+the services set no session state, so nothing relies on a connection
+outliving its transaction.
+"""
+import os
+import time
+
+from prometheus_client import Gauge, Histogram
+from sqlalchemy import event
+from sqlalchemy.pool import NullPool, QueuePool
+
+
+def engine_options_from_env(metrics):
+    """Return SQLALCHEMY_ENGINE_OPTIONS for the configured pool mode."""
+    if os.environ.get('DB_POOL_MODE', 'queue') == 'pgbouncer':
+        return {'poolclass': _timed_pool_class(NullPool, metrics)}
+    return {
+        'poolclass': _timed_pool_class(QueuePool, metrics),
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 5)),
+        'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true',
+    }
+
+
+class PoolMetrics:
+    def __init__(self, prefix):
+        self.checked_out = Gauge(f'{prefix}_db_pool_checked_out', 'Connections currently checked out of the pool',
+                                 multiprocess_mode='livesum')
+        self.overflow = Gauge(f'{prefix}_db_pool_overflow', 'Connections open beyond pool_size',
+                              multiprocess_mode='livesum')
+        self.size = Gauge(f'{prefix}_db_pool_size', 'Configured persistent pool size',
+                          multiprocess_mode='livesum')
+        self.checkout_wait = Histogram(
+            f'{prefix}_db_pool_checkout_wait_seconds', 'Time spent waiting for a pooled connection',
+            buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+        self.connect_duration = Histogram(
+            f'{prefix}_db_connect_duration_seconds', 'Time to open a new database connection',
+            buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+
+
+def instrument_engine(engine, metrics):
+    """Time new connections and report pool occupancy on every checkout and checkin."""
+
+    @event.listens_for(engine, 'do_connect')
+    def _timed_connect(dialect, conn_rec, cargs, cparams):
+        start = time.perf_counter()
+        try:
+            return dialect.loaded_dbapi.connect(*cargs, **cparams)
+        finally:
+            metrics.connect_duration.observe(time.perf_counter() - start)
+
+    # set on pool events rather than read at scrape time: multiprocess
+    # collection only sees values written to the metric files. Pool events
+    # registered on the engine carry over to the pool dispose() recreates.
+    @event.listens_for(engine, 'checkout')
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        metrics.checked_out.inc()
+        _report_overflow(engine.pool, metrics)
+
+    @event.listens_for(engine, 'checkin')
+    def _on_checkin(dbapi_connection, connection_record):
+        metrics.checked_out.dec()
+        _report_overflow(engine.pool, metrics)
+
+    report_pool_size(engine, metrics)
+
+
+def report_pool_size(engine, metrics):
+    """Publish the configured pool size; call again in each worker after fork."""
+    metrics.size.set(engine.pool.size() if isinstance(engine.pool, QueuePool) else 0)
+
+
+def _report_overflow(pool, metrics):
+    if isinstance(pool, QueuePool):
+        metrics.overflow.set(max(pool.overflow(), 0))
+
+
+def _timed_pool_class(base, metrics):
+    class TimedPool(base):
+        # recreate() after dispose() keeps the class, so timing survives forks
+        def _do_get(self):
+            start = time.perf_counter()
+            try:
+                return super()._do_get()
+            finally:
+                metrics.checkout_wait.observe(time.perf_counter() - start)
+
+    TimedPool.__name__ = f'Timed{base.__name__}'
+    return TimedPool
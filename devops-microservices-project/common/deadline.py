@@ -0,0 +1,46 @@
+"""Request deadline propagation.
+
+A caller sends its remaining time budget in DEADLINE_HEADER (milliseconds).
+The callee turns it into a local monotonic deadline at request start,
+rejects the request with 504 if the budget is already spent, and
+ServiceClient caps downstream timeouts to whatever is left and forwards the
+header on. A relative budget is used instead of a wall-clock timestamp so
+clock skew between containers doesn't matter.
+"""
+import time
+
+from flask import g, has_request_context, jsonify, request
+
+DEADLINE_HEADER = 'X-Request-Deadline-Ms'
+
+
+class DeadlineExceeded(Exception):
+    """Raised when the caller's deadline has passed before an upstream call."""
+
+
+def init_app(app, logger=None):
+    @app.before_request
+    def _read_deadline():
+        raw = request.headers.get(DEADLINE_HEADER)
+        if raw is None:
+            return None
+        try:
+            budget_ms = float(raw)
+        except ValueError:
+            return None
+        if budget_ms <= 0:
+            if logger:
+                logger.warning("Request deadline already exceeded", extra={'endpoint': request.path, 'status_code': 504})
+            return jsonify({"error": "Deadline exceeded"}), 504
+        g.deadline = time.monotonic() + budget_ms / 1000.0
+        return None
+
+
+def remaining():
+    """Seconds left before the current request's deadline, or None if it has none."""
+    if not has_request_context():
+        return None
+    deadline = g.get('deadline')
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
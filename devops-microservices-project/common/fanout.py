@@ -0,0 +1,79 @@
+"""Bounded concurrent fan-out for independent upstream calls.
+
+Runs on one thread pool per process, which becomes a greenlet pool when
+the gevent worker has monkey-patched the process (see
+common/gunicorn_conf.py). Each call runs in a copy of the caller's context
+variables, which carry the Flask request and app contexts (and so ``g``:
+deadlines and request-scoped state still apply) and the current trace span.
+
+    UPSTREAM_FANOUT_CONCURRENCY   calls in flight per bounded_map (default 8)
+    UPSTREAM_FANOUT_POOL_SIZE     threads shared by all requests in a process (default 32)
+"""
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from common.request_metrics import add_request_time, collecting_request_time
+
+DEFAULT_FANOUT_CONCURRENCY = int(os.environ.get('UPSTREAM_FANOUT_CONCURRENCY', 8))
+FANOUT_POOL_SIZE = int(os.environ.get('UPSTREAM_FANOUT_POOL_SIZE', 32))
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _executor():
+    # per process: a pool inherited across a fork has no threads behind it
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadPoolExecutor(max_workers=FANOUT_POOL_SIZE, thread_name_prefix='fanout')
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def bounded_map(fn, items, concurrency=DEFAULT_FANOUT_CONCURRENCY):
+    """Call fn on every item with at most ``concurrency`` calls in flight.
+
+    Returns results in input order. An exception raised by a call is
+    returned in place of its result so one failure doesn't discard the rest.
+    """
+    items = list(items)
+
+    def call(item):
+        try:
+            return fn(item)
+        except Exception as e:
+            return e
+
+    if len(items) <= 1 or concurrency <= 1:
+        return [call(item) for item in items]
+
+    pool = _executor()
+    slots = threading.BoundedSemaphore(concurrency)
+    start = time.perf_counter()
+    futures = []
+    for item in items:
+        slots.acquire()
+        # copy_current_request_context would push a fresh app context in the
+        # worker, leaving g (deadline, trace span) empty; copy the context
+        # variables instead, one copy per call since a context can't be
+        # entered by two threads at once
+        future = pool.submit(contextvars.copy_context().run, collecting_request_time, call, item)
+        future.add_done_callback(lambda _: slots.release())
+        futures.append(future)
+    outcomes = [future.result() for future in futures]
+
+    # the calls' dependency time, added on this thread since they share g;
+    # concurrent calls can't have taken longer than the fan-out itself
+    elapsed = time.perf_counter() - start
+    totals = {}
+    for _, collected in outcomes:
+        for dependency, seconds in collected.items():
+            totals[dependency] = totals.get(dependency, 0.0) + seconds
+    for dependency, seconds in totals.items():
+        add_request_time(dependency, min(seconds, elapsed))
+    return [result for result, _ in outcomes]
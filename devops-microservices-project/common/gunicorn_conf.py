@@ -0,0 +1,93 @@
+"""Gunicorn settings shared by user-service and product-service.
+
+Run from a service directory with:
+
+    gunicorn --config common/gunicorn_conf.py
+
+The app is preloaded in the master so imports happen once, then forked.
+Anything that must not be shared across a fork (database connections,
+Redis sockets, pooled HTTP sessions, background threads) is set up again
+in each worker by the service module's ``post_fork()``; ``init_db()`` runs
+once in the master before workers start.
+"""
+import glob
+import multiprocessing
+import os
+import sys
+
+# threads keep a worker busy while it waits on Postgres, Redis or the other
+# service. 'gevent' is the async mode: one process serves thousands of
+# in-flight requests on an event loop, with the unchanged sync code made
+# cooperative by monkey-patching. With preload_app that has to happen here,
+# before the app (and its sockets and locks) is imported.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+if worker_class == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+    # psycopg2 is a C extension; make its waits yield to the event loop too
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+# metrics from a previous run would be merged into this one's; clear them
+# before the app (and its metric files) is loaded
+multiproc_dir = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+if multiproc_dir:
+    os.makedirs(multiproc_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(multiproc_dir, '*.db')):
+        os.remove(path)
+
+wsgi_app = 'app:app'
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+
+# an event-loop worker already saturates its core. Every worker opens its own
+# database pool (common/db_pool.py), so deployments pin WEB_CONCURRENCY to
+# keep workers x pool within Postgres's max_connections
+default_workers = multiprocessing.cpu_count() if worker_class == 'gevent' else multiprocessing.cpu_count() * 2 + 1
+workers = int(os.environ.get('WEB_CONCURRENCY', default_workers))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+preload_app = True
+
+# recycle workers to bound memory growth; jitter avoids restarting them all at once
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# JSON logs come from the services themselves
+accesslog = None
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+def _service_module(server):
+    return sys.modules[server.app.app_uri.split(':')[0]]
+
+
+def _call_hook(server, name, *args):
+    hook = getattr(_service_module(server), name, None)
+    if hook is not None:
+        hook(*args)
+
+
+def when_ready(server):
+    _call_hook(server, 'init_db')
+    # before any worker forks
+    from common.prometheus_multiproc import master_ready
+    master_ready()
+
+
+def post_fork(server, worker):
+    _call_hook(server, 'post_fork')
+
+
+def worker_exit(server, worker):
+    _call_hook(server, 'worker_exit')
+
+
+# runs in the master, so it also covers workers that were killed
+def child_exit(server, worker):
+    from common.prometheus_multiproc import process_exited
+    process_exited(worker.pid)
@@ -0,0 +1,171 @@
+"""Pooled HTTP client for calls between the microservices.
+
+Each upstream gets one ServiceClient holding a keep-alive requests.Session
+with a bounded urllib3 pool, so repeated calls reuse TCP connections
+instead of opening a new one per request. Calls go through a per-upstream
+CircuitBreaker, honour the current request's deadline and propagate its
+trace.
+"""
+import os
+import time
+
+import requests
+from prometheus_client import Counter, Gauge, Histogram
+from requests.adapters import HTTPAdapter
+
+from common import deadline, tracing
+from common.circuit_breaker import STATE_VALUES, CircuitBreaker, CircuitOpenError
+from common.request_metrics import add_request_time
+
+DEFAULT_POOL_SIZE = int(os.environ.get('UPSTREAM_POOL_SIZE', 20))
+DEFAULT_TIMEOUT = float(os.environ.get('UPSTREAM_TIMEOUT', 2))
+DEFAULT_CONNECT_TIMEOUT = float(os.environ.get('UPSTREAM_CONNECT_TIMEOUT', 0.5))
+DEFAULT_POOL_BLOCK = os.environ.get('UPSTREAM_POOL_BLOCK', 'false').lower() == 'true'
+
+
+class UpstreamMetrics:
+    """Prometheus metrics shared by every ServiceClient of one service."""
+
+    def __init__(self, prefix):
+        self.request_duration = Histogram(
+            f'{prefix}_upstream_request_duration_seconds', 'Upstream request duration',
+            ['upstream', 'method', 'status'],
+            buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 5))
+        self.connect_duration = Histogram(
+            f'{prefix}_upstream_connect_duration_seconds', 'Upstream TCP connect duration',
+            ['upstream'],
+            buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5))
+        self.connections_opened = Counter(
+            f'{prefix}_upstream_connections_opened_total', 'New upstream connections opened', ['upstream'])
+        self.in_flight = Gauge(
+            f'{prefix}_upstream_in_flight_requests', 'Upstream requests currently using a pooled connection', ['upstream'],
+            multiprocess_mode='livesum')
+        self.pool_size = Gauge(
+            f'{prefix}_upstream_pool_size', 'Configured upstream connection pool size', ['upstream'],
+            multiprocess_mode='livesum')
+        # each worker has its own breaker; report the most open one
+        self.breaker_state = Gauge(
+            f'{prefix}_upstream_circuit_state', 'Upstream circuit breaker state (0 closed, 1 half-open, 2 open)', ['upstream'],
+            multiprocess_mode='livemax')
+        self.short_circuited = Counter(
+            f'{prefix}_upstream_short_circuited_total', 'Upstream calls skipped by an open breaker or spent deadline',
+            ['upstream', 'reason'])
+
+
+class _InstrumentedAdapter(HTTPAdapter):
+    """HTTPAdapter whose connections report connect time and churn."""
+
+    def __init__(self, upstream, metrics, **kwargs):
+        self._upstream = upstream
+        self._metrics = metrics
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        upstream, metrics = self._upstream, self._metrics
+        pool_classes = {}
+        for scheme, pool_cls in self.poolmanager.pool_classes_by_scheme.items():
+            base_conn = pool_cls.ConnectionCls
+
+            def connect(conn, _base=base_conn):
+                start = time.perf_counter()
+                _base.connect(conn)
+                metrics.connect_duration.labels(upstream).observe(time.perf_counter() - start)
+                metrics.connections_opened.labels(upstream).inc()
+
+            conn_cls = type(f'Timed{base_conn.__name__}', (base_conn,), {'connect': connect})
+            pool_classes[scheme] = type(f'Timed{pool_cls.__name__}', (pool_cls,), {'ConnectionCls': conn_cls})
+        self.poolmanager.pool_classes_by_scheme = pool_classes
+
+
+class ServiceClient:
+    """Keep-alive client for one upstream service.
+
+    ``get``/``post`` take a path relative to ``base_url`` and the usual
+    requests keyword arguments; ``timeout`` defaults to
+    (connect_timeout, timeout), capped by the request deadline.
+
+    Raises CircuitOpenError or deadline.DeadlineExceeded without touching
+    the network when the breaker is open or the deadline has passed.
+    Connection errors, timeouts and 5xx responses count as breaker failures.
+    """
+
+    def __init__(self, upstream, base_url, metrics, pool_size=DEFAULT_POOL_SIZE,
+                 timeout=DEFAULT_TIMEOUT, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                 pool_block=DEFAULT_POOL_BLOCK, breaker=None):
+        self.upstream = upstream
+        self.base_url = base_url.rstrip('/')
+        self.metrics = metrics
+        self.timeout = (connect_timeout, timeout)
+        self.pool_size = pool_size
+        self.pool_block = pool_block
+        self.session = self._new_session()
+        self.breaker = breaker or CircuitBreaker()
+        self.breaker.on_state_change = lambda state: metrics.breaker_state.labels(upstream).set(STATE_VALUES[state])
+        self._report_gauges()
+
+    def _report_gauges(self):
+        # again after fork: a worker's live gauges start out empty
+        self.metrics.pool_size.labels(self.upstream).set(self.pool_size)
+        self.metrics.breaker_state.labels(self.upstream).set(STATE_VALUES[self.breaker.state])
+
+    def _new_session(self):
+        session = requests.Session()
+        adapter = _InstrumentedAdapter(
+            self.upstream, self.metrics,
+            pool_connections=1, pool_maxsize=self.pool_size, pool_block=self.pool_block, max_retries=0)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def reset(self):
+        """Drop pooled connections, e.g. after fork so workers don't share sockets."""
+        self.session.close()
+        self.session = self._new_session()
+        self._report_gauges()
+
+    def request(self, method, path, **kwargs):
+        headers = dict(kwargs.pop('headers', None) or {})
+        connect_timeout, timeout = kwargs.pop('timeout', self.timeout)
+        remaining = deadline.remaining()
+        if remaining is not None:
+            if remaining <= 0:
+                self.metrics.short_circuited.labels(self.upstream, 'deadline').inc()
+                raise deadline.DeadlineExceeded(f"Deadline exceeded before calling {self.upstream}")
+            connect_timeout = min(connect_timeout, remaining)
+            timeout = min(timeout, remaining)
+            headers[deadline.DEADLINE_HEADER] = str(int(remaining * 1000))
+
+        if not self.breaker.allow():
+            self.metrics.short_circuited.labels(self.upstream, 'circuit_open').inc()
+            raise CircuitOpenError(f"Circuit open for {self.upstream}")
+
+        start = time.perf_counter()
+        self.metrics.in_flight.labels(self.upstream).inc()
+        try:
+            with tracing.span(f'{self.upstream} {method}', 'client', {'http.path': path}) as upstream_span:
+                # sent even when unsampled so the upstream logs share the trace ID
+                tracing.inject(headers)
+                response = self.session.request(method, self.base_url + path, headers=headers,
+                                                timeout=(connect_timeout, timeout), **kwargs)
+                if upstream_span is not None:
+                    upstream_span.set_attribute('http.status_code', response.status_code)
+        except requests.RequestException:
+            self.breaker.record_failure()
+            self.metrics.request_duration.labels(self.upstream, method, 'error').observe(time.perf_counter() - start)
+            raise
+        finally:
+            self.metrics.in_flight.labels(self.upstream).dec()
+            add_request_time('upstream', time.perf_counter() - start)
+        self.metrics.request_duration.labels(self.upstream, method, str(response.status_code)).observe(time.perf_counter() - start)
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
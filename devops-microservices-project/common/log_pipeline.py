@@ -0,0 +1,164 @@
+"""JSON logging shared by both services.
+
+In the default 'queue' mode the request thread only resolves the message
+and enqueues the record; a listener thread does the JSON encoding and the
+stream write. The queue is bounded, and records that don't fit are
+dropped and counted rather than blocking the request. INFO lines are
+sampled first (see common/log_sampling.py):
+
+    LOG_LEVEL        logger level (default INFO)
+    LOG_MODE         'queue' (default) or 'sync' to format and write inline
+    LOG_QUEUE_SIZE   records buffered before dropping (default 10000)
+
+Lines logged during a request carry its trace_id and span_id (see
+common/tracing.py).
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+
+from prometheus_client import Counter, Gauge
+
+from common.log_sampling import SamplingFilter
+from common.tracing import LogContextFilter
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is in requirements.txt
+    orjson = None
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_MODE = os.environ.get('LOG_MODE', 'queue')
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+
+# extra={...} fields copied into the log line
+EXTRA_FIELDS = ('user_id', 'product_id', 'user_name', 'endpoint', 'status_code', 'trace_id', 'span_id')
+
+
+def _dumps(entry):
+    if orjson is not None:
+        return orjson.dumps(entry, default=str).decode()
+    return json.dumps(entry, default=str)
+
+
+class JSONFormatter(logging.Formatter):
+    def __init__(self, service):
+        super().__init__()
+        self.service = service
+
+    def format(self, record):
+        # stamped from record.created, so a line formatted later on the
+        # listener thread still carries the time it was logged
+        seconds = int(record.created)
+        timestamp = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(seconds)) + '.%06dZ' % int((record.created - seconds) * 1e6)
+        log_entry = {
+            '@timestamp': timestamp,
+            'timestamp': timestamp,
+            'level': record.levelname,
+            'service': self.service,
+            'message': record.getMessage(),
+            'module': record.module,
+            'function': record.funcName,
+            'line': record.lineno
+        }
+
+        if record.exc_info:
+            log_entry['exception'] = self.formatException(record.exc_info)
+
+        for field in EXTRA_FIELDS:
+            if hasattr(record, field):
+                log_entry[field] = getattr(record, field)
+        # per-interval request summaries (common/log_sampling.py)
+        if hasattr(record, 'summary'):
+            log_entry.update(record.summary)
+
+        return _dumps(log_entry)
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue, dropped, depth):
+        super().__init__(log_queue)
+        self.dropped = dropped
+        self.depth = depth
+
+    def prepare(self, record):
+        # the base class formats here, on the request thread; only resolve
+        # the message so later changes to mutable args can't leak in
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped.labels(record.levelname).inc()
+        self.depth.set(self.queue.qsize())
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # wait for room: the stop sentinel must not be dropped on a full queue
+        self.queue.put(self._sentinel)
+
+
+class LogPipeline:
+    """The service logger and, in queue mode, its background writer."""
+
+    def __init__(self, service, level=LOG_LEVEL, mode=LOG_MODE, queue_size=LOG_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.queue_handler = None
+        self.listener = None
+        self.stream_handler = logging.StreamHandler(sys.stderr)
+        self.stream_handler.setFormatter(JSONFormatter(service))
+
+        self.logger = logging.getLogger(service)
+        self.logger.setLevel(level)
+        # Remove any existing handlers to avoid duplicates
+        for handler in self.logger.handlers[:]:
+            self.logger.removeHandler(handler)
+        # JSON lines only; not also through root handlers (e.g. alembic's console)
+        self.logger.propagate = False
+        # drop sampled-out INFO lines before they reach the queue
+        self.logger.addFilter(SamplingFilter())
+        # trace IDs live in a context variable, so read them on the request thread
+        self.logger.addFilter(LogContextFilter())
+
+        if mode != 'queue':
+            self.logger.addHandler(self.stream_handler)
+            return
+
+        dropped = Counter(f'{service}_log_records_dropped_total', 'Log records dropped because the log queue was full', ['level'])
+        # sampled as records are enqueued
+        depth = Gauge(f'{service}_log_queue_depth', 'Log records waiting to be written', multiprocess_mode='livesum')
+        self.queue_handler = _DroppingQueueHandler(queue.Queue(queue_size), dropped, depth)
+        self.logger.addHandler(self.queue_handler)
+        self.start()
+        atexit.register(self.stop)
+
+    def start(self):
+        if self.listener is None and self.queue_handler is not None:
+            self.listener = _QueueListener(self.queue_handler.queue, self.stream_handler, respect_handler_level=True)
+            self.listener.start()
+
+    def stop(self):
+        """Drain queued records and stop the writer thread."""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def after_fork(self):
+        """Restart the writer in a forked worker.
+
+        The parent's thread doesn't survive the fork and its queue lock may
+        have been held mid-write, so the worker gets a fresh queue.
+        """
+        if self.queue_handler is not None:
+            self.queue_handler.queue = queue.Queue(self.queue_size)
+            self.listener = None
+            self.start()
@@ -0,0 +1,171 @@
+"""Log sampling and per-interval request summaries.
+
+Warnings and errors are always written. INFO lines are kept for a sampled
+share of requests (the decision is made once per request, so a kept
+request keeps all of its lines), and dropped entirely for muted probe and
+scrape endpoints. In place of the dropped lines, ``RequestSummary`` writes
+one record per endpoint per interval with request counts, the status mix,
+latency percentiles and the cache hit ratio:
+
+    LOG_SAMPLE_RATE        share of requests whose INFO lines are kept (default 1.0)
+    LOG_SAMPLE_RATES       per-endpoint overrides, e.g. "/products=0.1,/user/<int:user_id>=0.05"
+    LOG_MUTED_ENDPOINTS    endpoints whose INFO lines are never kept (default "/health,/metrics")
+    LOG_SUMMARY_INTERVAL   seconds between summaries; 0 disables them (default 60)
+"""
+import logging
+import os
+import random
+import threading
+import time
+
+from flask import g, has_request_context, request
+
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 1.0))
+LOG_SAMPLE_RATES = os.environ.get('LOG_SAMPLE_RATES', '')
+LOG_MUTED_ENDPOINTS = os.environ.get('LOG_MUTED_ENDPOINTS', '/health,/metrics')
+LOG_SUMMARY_INTERVAL = float(os.environ.get('LOG_SUMMARY_INTERVAL', 60))
+
+# latencies kept per endpoint per interval; beyond this they are reservoir-sampled
+MAX_LATENCY_SAMPLES = 10000
+
+
+def parse_rates(spec):
+    """Parse "endpoint=rate,..." into {endpoint: rate}, raising ValueError on bad input."""
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        endpoint, sep, rate = item.rpartition('=')
+        if not sep or not endpoint:
+            raise ValueError(f"Invalid log sample rate {item!r}")
+        rates[endpoint] = float(rate)
+    return rates
+
+
+def _muted(spec):
+    return frozenset(filter(None, (part.strip() for part in spec.split(','))))
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, default_rate=LOG_SAMPLE_RATE, rates=None, muted=None):
+        super().__init__()
+        self.default_rate = default_rate
+        self.rates = parse_rates(LOG_SAMPLE_RATES) if rates is None else rates
+        self.muted = _muted(LOG_MUTED_ENDPOINTS) if muted is None else frozenset(muted)
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or hasattr(record, 'summary'):
+            return True
+        endpoint = getattr(record, 'endpoint', None)
+        if endpoint in self.muted:
+            return False
+        rate = self.rates.get(endpoint, self.default_rate)
+        if rate >= 1:
+            return True
+        if rate <= 0:
+            return False
+        if not has_request_context():
+            return random.random() < rate
+        sampled = g.get('log_sampled')
+        if sampled is None:
+            sampled = g.log_sampled = random.random() < rate
+        return sampled
+
+
+class _EndpointStats:
+    def __init__(self):
+        self.count = 0
+        self.statuses = {}
+        self.latencies = []
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def add(self, status, seconds, cache_hits, cache_misses):
+        self.count += 1
+        status_class = f"{status // 100}xx"
+        self.statuses[status_class] = self.statuses.get(status_class, 0) + 1
+        if len(self.latencies) < MAX_LATENCY_SAMPLES:
+            self.latencies.append(seconds)
+        else:
+            slot = random.randrange(self.count)
+            if slot < MAX_LATENCY_SAMPLES:
+                self.latencies[slot] = seconds
+        self.cache_hits += cache_hits
+        self.cache_misses += cache_misses
+
+    def summary(self, method, interval):
+        latencies = sorted(self.latencies)
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            'method': method,
+            'interval_seconds': interval,
+            'count': self.count,
+            'statuses': self.statuses,
+            'p50_ms': _percentile_ms(latencies, 0.50),
+            'p95_ms': _percentile_ms(latencies, 0.95),
+            'p99_ms': _percentile_ms(latencies, 0.99),
+            'cache_hit_ratio': round(self.cache_hits / lookups, 4) if lookups else None,
+        }
+
+
+def _percentile_ms(ordered, quantile):
+    index = min(len(ordered) - 1, max(0, int(round(quantile * len(ordered))) - 1))
+    return round(ordered[index] * 1000, 2)
+
+
+class RequestSummary:
+    """Aggregates every request per endpoint and logs one summary record per interval."""
+
+    def __init__(self, logger, interval=LOG_SUMMARY_INTERVAL, muted=None):
+        self.logger = logger
+        self.interval = interval
+        self.muted = _muted(LOG_MUTED_ENDPOINTS) if muted is None else frozenset(muted)
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._thread = None
+        self._stop = threading.Event()
+
+    def init_app(self, app):
+        if self.interval <= 0:
+            return
+        app.before_request(self._start_request)
+        app.after_request(self._end_request)
+
+    def _start_request(self):
+        g.summary_start = time.perf_counter()
+
+    def _end_request(self, response):
+        start = g.get('summary_start')
+        if start is None:
+            return response
+        endpoint = request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+        if endpoint in self.muted:
+            return response
+        seconds = time.perf_counter() - start
+        key = (request.method, endpoint)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = _EndpointStats()
+            stats.add(response.status_code, seconds, g.get('cache_hits', 0), g.get('cache_misses', 0))
+        return response
+
+    def start(self):
+        if self.interval <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='request-summary', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the timer and write out the partial interval."""
+        self._stop.set()
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            stats, self._stats = self._stats, {}
+        for (method, endpoint), endpoint_stats in stats.items():
+            self.logger.info("Request summary", extra={'endpoint': endpoint, 'summary': endpoint_stats.summary(method, self.interval)})
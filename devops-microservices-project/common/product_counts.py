@@ -0,0 +1,11 @@
+"""Per-user product counters kept in Redis.
+
+product-service adjusts them with INCRBY on every create and delete and
+reconciles them against Postgres periodically; user-service reads them
+directly instead of calling product-service. A missing key means the
+user owns no products.
+"""
+
+
+def product_count_key(user_id):
+    return f"products:count:user:{user_id}"
@@ -0,0 +1,116 @@
+"""Prometheus metrics shared across gunicorn workers.
+
+With PROMETHEUS_MULTIPROC_DIR set (the Dockerfiles set it), prometheus_client
+keeps every metric in per-process mmap files in that directory and
+``/metrics`` merges the files of all workers, so a scrape sees the whole
+service rather than whichever worker answered it. common/gunicorn_conf.py
+empties the directory when the master starts.
+
+Gauges declare how workers combine: ``livesum``/``livemax`` for
+point-in-time values, whose files are deleted when a worker exits, and
+``sum`` for running totals. Counters, histograms and ``sum`` gauges must
+outlive their worker, so when one exits the master folds its files into
+one archive file per type. Scrape cost then tracks the number of live
+workers instead of growing with every recycled one.
+
+The master's own live gauges are dropped once the app is loaded
+(``master_ready``); workers publish theirs after fork.
+
+Without the variable (e.g. ``python app.py``) the default per-process
+registry is used.
+"""
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+
+from prometheus_client import REGISTRY, CollectorRegistry, generate_latest
+from prometheus_client.mmap_dict import MmapedDict
+from prometheus_client.multiprocess import MultiProcessCollector, mark_process_dead
+
+MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+# file prefixes whose values must survive the process that wrote them
+ARCHIVED_TYPES = ('counter', 'histogram', 'summary', 'gauge_sum')
+LOCK_FILE = 'compaction.lock'
+
+
+@contextmanager
+def _locked(path, mode):
+    # shared for scrapes, exclusive while the master rewrites archives, so a
+    # scrape never sees a dead worker's values both archived and unarchived
+    with open(os.path.join(path, LOCK_FILE), 'a') as lock:
+        fcntl.flock(lock, mode)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+class _LockedCollector(MultiProcessCollector):
+    def collect(self):
+        with _locked(self._path, fcntl.LOCK_SH):
+            return list(super().collect())
+
+
+def _build_registry():
+    if not MULTIPROC_DIR:
+        return REGISTRY
+    registry = CollectorRegistry()
+    _LockedCollector(registry, path=MULTIPROC_DIR)
+    return registry
+
+
+# built once; each scrape only re-reads the metric files
+_registry = _build_registry()
+
+
+def metrics_output():
+    """Exposition-format metrics for this service, merged across workers when multiprocess."""
+    return generate_latest(_registry)
+
+
+def master_ready(path=MULTIPROC_DIR):
+    """Drop the master's live gauges before workers fork (run in the master).
+
+    With preload_app the master sets gauges while importing the app (pool
+    sizes, capacities); its files would otherwise count as one more live
+    process for as long as it runs. Workers set their own after fork.
+    """
+    if not path:
+        return
+    mark_process_dead(os.getpid(), path)
+
+
+def process_exited(pid, path=MULTIPROC_DIR):
+    """Drop an exited worker's live gauges and archive its other metric files (run in the master)."""
+    if not path:
+        return
+    mark_process_dead(pid, path)
+    with _locked(path, fcntl.LOCK_EX):
+        for prefix in ARCHIVED_TYPES:
+            dead = os.path.join(path, f'{prefix}_{pid}.db')
+            if os.path.exists(dead):
+                _archive(path, prefix, dead)
+
+
+def _archive(path, prefix, dead):
+    archive = os.path.join(path, f'{prefix}_archive.db')
+    sources = [f for f in (archive, dead) if os.path.exists(f)]
+    # accumulate=False keeps histogram buckets per-bucket, as stored on disk
+    merged = MultiProcessCollector.merge(sources, accumulate=False)
+
+    staging = archive + '.tmp'
+    if os.path.exists(staging):
+        os.remove(staging)
+    values = MmapedDict(staging)
+    try:
+        for metric in merged:
+            for sample in metric.samples:
+                key = json.dumps([metric.name, sample.name, sample.labels, metric.documentation], sort_keys=True)
+                values.write_value(key, sample.value)
+    finally:
+        values.close()
+    os.replace(staging, archive)
+    os.remove(dead)
+
@@ -0,0 +1,129 @@
+"""Per-request Prometheus metrics recorded by before/after_request hooks.
+
+Every request is counted and timed by method, route and status under the
+existing ``<prefix>_requests_total`` and ``<prefix>_request_duration_seconds``
+names, so the alert rules keep working. Time spent in Postgres, Redis and
+upstream HTTP calls is summed per request (``add_request_time``) and
+observed as separate per-route histograms, which tells a slow query apart
+from a slow dependency.
+
+Streaming responses are timed to their first byte: after_request runs
+before the body is generated.
+"""
+import time
+from contextvars import ContextVar
+
+import redis
+from flask import g, has_request_context, request
+from prometheus_client import Counter, Histogram
+from sqlalchemy import event
+
+# request latencies cluster well under a second; the tail buckets catch
+# timeouts (30s is gunicorn's worker timeout)
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.15, 0.25, 0.5, 0.75, 1, 2.5, 5, 10, 30)
+DEPENDENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+# routes not recorded (Prometheus scrapes)
+SKIPPED_ROUTES = frozenset({'/metrics'})
+
+DEPENDENCIES = ('db', 'redis', 'upstream')
+
+# set in fanned-out calls, which share the caller's g across threads
+_collected_time = ContextVar('collected_request_time', default=None)
+
+
+def add_request_time(dependency, seconds):
+    """Add time spent in a dependency ('db', 'redis' or 'upstream') to the current request."""
+    collected = _collected_time.get()
+    if collected is not None:
+        collected[dependency] = collected.get(dependency, 0.0) + seconds
+    elif has_request_context():
+        attr = f'{dependency}_seconds'
+        setattr(g, attr, g.get(attr, 0.0) + seconds)
+
+
+def collecting_request_time(fn, *args):
+    """Call fn and return (result, {dependency: seconds}) instead of adding its time to g.
+
+    Run it in its own context (``contextvars.copy_context().run``); the
+    caller adds the collected time back on the request thread.
+    """
+    collected = {}
+    _collected_time.set(collected)
+    return fn(*args), collected
+
+
+class RequestMetrics:
+    def __init__(self, prefix):
+        self.requests = Counter(f'{prefix}_requests_total', 'Total requests', ['method', 'endpoint', 'status'])
+        self.duration = Histogram(f'{prefix}_request_duration_seconds', 'Request duration',
+                                  ['method', 'endpoint', 'status'], buckets=REQUEST_BUCKETS)
+        self.dependency_time = {
+            'db': Histogram(f'{prefix}_request_db_seconds', 'Time spent in database queries per request',
+                            ['endpoint'], buckets=DEPENDENCY_BUCKETS),
+            'redis': Histogram(f'{prefix}_request_redis_seconds', 'Time spent in Redis commands per request',
+                               ['endpoint'], buckets=DEPENDENCY_BUCKETS),
+            'upstream': Histogram(f'{prefix}_request_upstream_seconds', 'Time spent calling other services per request',
+                                  ['endpoint'], buckets=DEPENDENCY_BUCKETS),
+        }
+
+    def init_app(self, app):
+        app.before_request(self._start_request)
+        app.after_request(self._end_request)
+
+    def _start_request(self):
+        g.request_start = time.perf_counter()
+
+    def _end_request(self, response):
+        start = g.get('request_start')
+        if start is None:
+            return response
+        # the route pattern, not the path, keeps label cardinality bounded
+        endpoint = request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+        if endpoint in SKIPPED_ROUTES:
+            return response
+        status = str(response.status_code)
+        self.requests.labels(request.method, endpoint, status).inc()
+        self.duration.labels(request.method, endpoint, status).observe(time.perf_counter() - start)
+        for dependency in DEPENDENCIES:
+            self.dependency_time[dependency].labels(endpoint).observe(g.get(f'{dependency}_seconds', 0.0))
+        return response
+
+
+def instrument_engine_timing(engine):
+    """Add the duration of every statement run during a request to its db time."""
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        add_request_time('db', time.perf_counter() - conn.info['query_start'].pop())
+
+    @event.listens_for(engine, 'handle_error')
+    def _error(context):
+        if context.connection is not None and context.connection.info.get('query_start'):
+            add_request_time('db', time.perf_counter() - context.connection.info['query_start'].pop())
+
+
+class TimedRedisConnection(redis.Connection):
+    """Redis connection that adds its socket time to the current request's redis time.
+
+    Timing the connection rather than the client covers plain commands and
+    pipelines alike.
+    """
+
+    def send_packed_command(self, command, check_health=True):
+        start = time.perf_counter()
+        try:
+            return super().send_packed_command(command, check_health)
+        finally:
+            add_request_time('redis', time.perf_counter() - start)
+
+    def read_response(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().read_response(*args, **kwargs)
+        finally:
+            add_request_time('redis', time.perf_counter() - start)
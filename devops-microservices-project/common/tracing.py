@@ -0,0 +1,373 @@
+"""Request tracing across user-service and product-service.
+
+Every request gets a trace: the ``traceparent`` header (W3C format) is
+read if the caller sent one, otherwise a new trace ID is created.
+ServiceClient forwards the header, so a hop like /user/{id} ->
+/products/count stays in one trace. The trace ID is attached to every log
+line written during the request.
+
+Sampling is decided once at the head of the trace (TRACE_SAMPLE_RATE, or
+the caller's sampled flag) and inherited downstream. Unsampled requests
+carry IDs but record no spans, which keeps the overhead bounded. Sampled
+requests record child spans for SQL statements, Redis commands and
+pipelines, and upstream calls, and hand the whole trace to the exporter
+when the request ends:
+
+    TRACE_SAMPLE_RATE     share of new traces recorded (default 0.1)
+    TRACE_EXPORTER        'none' (default), 'memory' (ring buffer) or 'file'
+                          (rotating JSON lines)
+    TRACE_DEBUG_ENDPOINT  'true' serves the memory exporter's spans at
+                          /debug/traces (default 'false'; unauthenticated and
+                          includes SQL text, so keep it off in production)
+    TRACE_FILE            JSON-lines path for the file exporter, one file per
+                          process (default logs/traces-{pid}.jsonl)
+    TRACE_BUFFER_SIZE     spans kept by the memory exporter (default 10000)
+
+Any object with an ``export(spans)`` method (and optionally ``close()``) can
+be passed as the exporter.
+"""
+import collections
+import logging
+import logging.handlers
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import redis
+from flask import g, jsonify, request
+from sqlalchemy import event
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is in requirements.txt
+    orjson = None
+    import json
+
+TRACE_HEADER = 'traceparent'
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', 0.1))
+TRACE_EXPORTER = os.environ.get('TRACE_EXPORTER', 'none')
+TRACE_DEBUG_ENDPOINT = os.environ.get('TRACE_DEBUG_ENDPOINT', 'false').lower() == 'true'
+TRACE_FILE = os.environ.get('TRACE_FILE', os.path.join('logs', 'traces-{pid}.jsonl'))
+TRACE_FILE_MAX_BYTES = int(os.environ.get('TRACE_FILE_MAX_BYTES', 10 * 1024 * 1024))
+TRACE_FILE_BACKUPS = int(os.environ.get('TRACE_FILE_BACKUPS', 5))
+TRACE_BUFFER_SIZE = int(os.environ.get('TRACE_BUFFER_SIZE', 10000))
+
+# SQL text is truncated in span attributes
+MAX_STATEMENT_LENGTH = 500
+
+_current_span = ContextVar('current_span', default=None)
+
+
+def _random_id(nbytes):
+    return f'{random.getrandbits(nbytes * 8):0{nbytes * 2}x}'
+
+
+class _Trace:
+    """Finished spans of one sampled trace within this process."""
+
+    def __init__(self):
+        self.spans = []
+        self.lock = threading.Lock()
+
+
+class Span:
+    def __init__(self, service, trace_id, parent_id, name, kind, sampled, trace, attributes=None):
+        self.service = service
+        self.trace_id = trace_id
+        self.span_id = _random_id(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.sampled = sampled
+        self.trace = trace
+        self.attributes = attributes or {}
+        self.status = 'ok'
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.duration_ms = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def end(self, error=None):
+        if self.duration_ms is not None:
+            return
+        self.duration_ms = round((time.perf_counter() - self._start) * 1000, 3)
+        if error is not None:
+            self.status = 'error'
+            self.attributes['error'] = str(error)
+        if self.sampled:
+            with self.trace.lock:
+                self.trace.spans.append(self)
+
+    def child(self, name, kind='internal', attributes=None):
+        return Span(self.service, self.trace_id, self.span_id, name, kind, self.sampled, self.trace, attributes)
+
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'service': self.service,
+            'name': self.name,
+            'kind': self.kind,
+            'start_time': self.start_time,
+            'duration_ms': self.duration_ms,
+            'status': self.status,
+            'attributes': self.attributes,
+        }
+
+
+def current_span():
+    return _current_span.get()
+
+
+def start_child(name, kind='internal', attributes=None):
+    """Start a child of the current span, or return None when there is nothing sampled to attach to.
+
+    For callbacks that can't wrap the work in ``span()``; call ``end()`` on the result.
+    """
+    parent = _current_span.get()
+    if parent is None or not parent.sampled:
+        return None
+    return parent.child(name, kind, attributes)
+
+
+@contextmanager
+def span(name, kind='internal', attributes=None):
+    """Record the enclosed block as a child span; yields the span, or None when unsampled."""
+    child = start_child(name, kind, attributes)
+    if child is None:
+        yield None
+        return
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.end(error=e)
+        raise
+    finally:
+        _current_span.reset(token)
+        child.end()
+
+
+def inject(headers):
+    """Add the trace header for an outgoing call made from the current span."""
+    current = _current_span.get()
+    if current is not None:
+        headers[TRACE_HEADER] = current.traceparent()
+    return headers
+
+
+def _parse_traceparent(value):
+    parts = value.split('-') if value else ()
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16 or len(parts[3]) != 2:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+        flags = int(parts[3], 16)
+    except ValueError:
+        return None
+    if parts[1] == '0' * 32:
+        return None
+    return parts[1], parts[2], bool(flags & 1)
+
+
+class RingBufferExporter:
+    """Keeps the most recent spans in memory."""
+
+    def __init__(self, size=TRACE_BUFFER_SIZE):
+        self._spans = collections.deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        with self._lock:
+            self._spans.extend(span.to_dict() for span in spans)
+
+    def spans(self, trace_id=None):
+        with self._lock:
+            spans = list(self._spans)
+        if trace_id is not None:
+            spans = [span for span in spans if span['trace_id'] == trace_id]
+        return spans
+
+
+class JsonLinesFileExporter:
+    """Appends one JSON line per span to a size-rotated file.
+
+    ``{pid}`` in the path is replaced by the writing process's ID; rotation
+    isn't safe with several gunicorn workers sharing one file.
+    """
+
+    def __init__(self, path=TRACE_FILE, max_bytes=TRACE_FILE_MAX_BYTES, backup_count=TRACE_FILE_BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._handler = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _current_handler(self):
+        # opened on first export, so each forked worker gets its own file
+        with self._lock:
+            if self._pid != os.getpid():
+                path = self.path.format(pid=os.getpid())
+                directory = os.path.dirname(path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                # RotatingFileHandler brings rotation and a write lock
+                self._handler = logging.handlers.RotatingFileHandler(
+                    path, maxBytes=self.max_bytes, backupCount=self.backup_count)
+                self._handler.setFormatter(logging.Formatter('%(message)s'))
+                self._pid = os.getpid()
+            return self._handler
+
+    def export(self, spans):
+        lines = '\n'.join(_dumps(span.to_dict()) for span in spans)
+        self._current_handler().handle(logging.makeLogRecord({'msg': lines, 'levelno': logging.INFO, 'levelname': 'INFO'}))
+
+    def close(self):
+        with self._lock:
+            if self._handler is not None and self._pid == os.getpid():
+                self._handler.close()
+            self._handler = self._pid = None
+
+
+def _dumps(value):
+    if orjson is not None:
+        return orjson.dumps(value).decode()
+    return json.dumps(value)
+
+
+def exporter_from_env():
+    if TRACE_EXPORTER == 'file':
+        return JsonLinesFileExporter()
+    if TRACE_EXPORTER == 'memory':
+        return RingBufferExporter()
+    return None
+
+
+class Tracer:
+    def __init__(self, service, exporter=None, sample_rate=TRACE_SAMPLE_RATE, debug_endpoint=TRACE_DEBUG_ENDPOINT):
+        self.service = service
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.debug_endpoint = debug_endpoint
+
+    def init_app(self, app):
+        app.before_request(self._start_request)
+        app.teardown_request(self._end_request)
+
+        @app.after_request
+        def _record_status(response):
+            root = g.get('trace_root')
+            if root is not None:
+                root.set_attribute('http.status_code', response.status_code)
+                if response.status_code >= 500:
+                    root.status = 'error'
+            return response
+
+        if self.debug_endpoint and isinstance(self.exporter, RingBufferExporter):
+            @app.route('/debug/traces')
+            def debug_traces():
+                trace_id = request.args.get('trace_id')
+                return jsonify({"spans": self.exporter.spans(trace_id)})
+
+    def _start_request(self):
+        parent = _parse_traceparent(request.headers.get(TRACE_HEADER))
+        if parent is not None:
+            trace_id, parent_id, sampled = parent
+        else:
+            trace_id, parent_id = _random_id(16), None
+            sampled = self.exporter is not None and random.random() < self.sample_rate
+        # a route pattern rather than the path keeps span names low-cardinality
+        route = request.url_rule.rule if request.url_rule is not None else request.path
+        root = Span(self.service, trace_id, parent_id, f'{request.method} {route}', 'server',
+                    sampled and self.exporter is not None, _Trace())
+        g.trace_root = root
+        g.trace_token = _current_span.set(root)
+
+    def _end_request(self, error=None):
+        root = g.pop('trace_root', None)
+        token = g.pop('trace_token', None)
+        if root is None:
+            return
+        if token is not None:
+            try:
+                _current_span.reset(token)
+            except ValueError:
+                # torn down from another context (streamed responses)
+                _current_span.set(None)
+        root.end(error)
+        if root.sampled:
+            with root.trace.lock:
+                spans = list(root.trace.spans)
+            try:
+                self.exporter.export(spans)
+            except Exception:
+                # tracing must never fail a request
+                pass
+
+    def close(self):
+        """Release the exporter's resources (gunicorn worker_exit)."""
+        close = getattr(self.exporter, 'close', None)
+        if close is not None:
+            close()
+
+
+class LogContextFilter(logging.Filter):
+    """Stamps records with the current trace and span IDs (read later by the JSON formatter)."""
+
+    def filter(self, record):
+        current = _current_span.get()
+        if current is not None:
+            record.trace_id = current.trace_id
+            record.span_id = current.span_id
+        return True
+
+
+def instrument_engine_tracing(engine):
+    """Record a span for every SQL statement run in a sampled request."""
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        child = start_child('db.query', 'client', {'db.statement': statement[:MAX_STATEMENT_LENGTH]})
+        conn.info.setdefault('trace_spans', []).append(child)
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        child = conn.info['trace_spans'].pop()
+        if child is not None:
+            child.set_attribute('db.rows', cursor.rowcount)
+            child.end()
+
+    @event.listens_for(engine, 'handle_error')
+    def _error(context):
+        spans = context.connection.info.get('trace_spans') if context.connection is not None else None
+        if spans:
+            child = spans.pop()
+            if child is not None:
+                child.end(error=context.original_exception)
+
+
+class TracedRedis(redis.Redis):
+    """Redis client recording a span per command and per pipeline."""
+
+    def execute_command(self, *args, **options):
+        with span(f'redis {args[0]}', 'client'):
+            return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return TracedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class TracedPipeline(redis.client.Pipeline):
+    def execute(self, raise_on_error=True):
+        with span('redis pipeline', 'client', {'redis.commands': len(self.command_stack)}):
+            return super().execute(raise_on_error)
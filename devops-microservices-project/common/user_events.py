@@ -0,0 +1,22 @@
+"""User change events shared over a Redis Stream.
+
+user-service appends an entry whenever a user is created or renamed;
+product-service reads them through a consumer group to keep its local
+copy of creator names current.
+"""
+import os
+
+USER_EVENTS_STREAM = os.environ.get('USER_EVENTS_STREAM', 'users:events')
+# approximate cap on retained entries (XADD MAXLEN ~)
+USER_EVENTS_MAXLEN = int(os.environ.get('USER_EVENTS_MAXLEN', 100000))
+
+USER_CREATED = 'user.created'
+USER_RENAMED = 'user.renamed'
+
+
+def publish_user_event(redis_client, event_type, user_id, name):
+    """Append one event and return its stream id."""
+    return redis_client.xadd(
+        USER_EVENTS_STREAM,
+        {'type': event_type, 'user_id': str(user_id), 'name': name},
+        maxlen=USER_EVENTS_MAXLEN, approximate=True)
@@ -11,6 +11,9 @@ function App() {
   const [password, setPassword] = useState('');
   const [token, setToken] = useState(localStorage.getItem('token') || '');
   const [products, setProducts] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [searchQuery, setSearchQuery] = useState('');
+  const [activeSearch, setActiveSearch] = useState('');
   const [productName, setProductName] = useState('');
   const [productPrice, setProductPrice] = useState('');
   const [productDescription, setProductDescription] = useState('');
@@ -104,17 +107,27 @@ function App() {
     setProductDescription('');
     setEditingProductId(null);
     setProducts([]);
+    setNextCursor(null);
+    setSearchQuery('');
+    setActiveSearch('');
   };
 
-  const fetchProducts = async () => {
+  const fetchProducts = async (cursor = null, search = activeSearch) => {
     try {
-      const res = await fetch(`${apiProductUrl}/products`, {
+      // searches are ranked server-side; otherwise page through the catalog
+      const params = new URLSearchParams();
+      if (search) params.set('q', search);
+      if (cursor) params.set('cursor', cursor);
+      const path = search ? '/products/search' : '/products';
+      const query = params.toString() ? `?${params}` : '';
+      const res = await fetch(`${apiProductUrl}${path}${query}`, {
         headers: {
           'Authorization': `Bearer ${token}` 
         }
       });
       const data = await res.json();
-      setProducts(data);
+      setProducts(cursor ? (prev) => [...prev, ...data.products] : data.products);
+      setNextCursor(data.next_cursor);
     } catch (error) {
       console.error('Error fetching products:', error);
       alert('Failed to fetch products');
@@ -186,6 +199,13 @@ function App() {
     }
   };
 
+  const handleSearch = (e) => {
+    e.preventDefault();
+    const search = searchQuery.trim();
+    setActiveSearch(search);
+    fetchProducts(null, search);
+  };
+
   const handleEdit = (product) => {
     setProductName(product.name);
     setProductPrice(product.price.toString());
@@ -295,6 +315,17 @@ function App() {
             </button>
           </form>
 
+          <form onSubmit={handleSearch} className="d-flex mb-3">
+            <input 
+              type="search" 
+              className="form-control me-2" 
+              placeholder="Search products" 
+              value={searchQuery} 
+              onChange={(e) => setSearchQuery(e.target.value)} 
+            />
+            <button type="submit" className="btn btn-outline-primary">Search</button>
+          </form>
+
           <ul className="list-group">
             {products.map((product) => (
               <li key={product.id} className="list-group-item d-flex justify-content-between align-items-center">
@@ -311,6 +342,11 @@ function App() {
               </li>
             ))}
           </ul>
+          {nextCursor && (
+            <div className="text-center mt-3">
+              <button onClick={() => fetchProducts(nextCursor)} className="btn btn-outline-secondary">Load more</button>
+            </div>
+          )}
         </div>
       )}
     </div>
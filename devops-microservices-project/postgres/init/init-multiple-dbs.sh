@@ -33,6 +33,9 @@ psql -v ON_ERROR_STOP=1 --username "$POSTGRES_USER" --dbname "product_db" <<-EOS
     
     -- Enable pg_stat_statements extension for product_db
     CREATE EXTENSION IF NOT EXISTS pg_stat_statements;
+
+    -- Trigram matching for /products/search
+    CREATE EXTENSION IF NOT EXISTS pg_trgm;
     
     -- Grant monitoring permissions
     GRANT pg_read_all_stats TO user_service;
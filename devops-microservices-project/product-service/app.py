@@ -1,235 +1,392 @@
-from flask_migrate import Migrate
-from flask import Flask, jsonify, request
+from flask_migrate import Migrate, stamp, upgrade
+from flask import Flask, Response, has_app_context, jsonify, request, stream_with_context
 from flask_cors import CORS
 import time
-from model import db, Product
+from contextlib import nullcontext
+from model import db, Creator, Product, parse_price
+from creator_sync import CreatorSync, upsert_creators
+from count_reconciler import CountReconciler, reconcile_product_counts
+from pagination import PageRequest
+from search import SearchRequest
+from bulk import apply_bulk_operations
 import redis
+from sqlalchemy import inspect, select, text
 from sqlalchemy.exc import OperationalError
 import os
 import json
-import requests
-from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
-import logging
-import logging.handlers
-import datetime
+from common import deadline
+from common.tracing import TracedRedis, Tracer, exporter_from_env, instrument_engine_tracing
+from common.log_pipeline import LogPipeline
+from common.log_sampling import RequestSummary
+from common.prometheus_multiproc import metrics_output
+from common.request_metrics import RequestMetrics, TimedRedisConnection, instrument_engine_timing
+from common.db_pool import PoolMetrics, engine_options_from_env, instrument_engine, report_pool_size
+from common.cache import CacheMetrics, TieredCache
+from common.fanout import bounded_map
+from common.product_counts import product_count_key
+from common.http_client import ServiceClient, UpstreamMetrics
+from prometheus_client import Counter, CONTENT_TYPE_LATEST
 
 app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+DB_POOL_METRICS = PoolMetrics('product_service')
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options_from_env(DB_POOL_METRICS)
 
 db.init_app(app)
-migrate = Migrate(app, db)
+migrate = Migrate(app, db, directory=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations'))
 CORS(app)
 
 app.app_context().push()
+instrument_engine(db.engine, DB_POOL_METRICS)
+instrument_engine_timing(db.engine)
+instrument_engine_tracing(db.engine)
 
 # Redis setup
 redis_host = os.environ.get('REDIS_HOST', 'redis')
 redis_port = int(os.environ.get('REDIS_PORT', 6379))
-redis_client = redis.Redis(host=redis_host, port=redis_port, db=0, decode_responses=True)
+# connections time their socket I/O into the current request's Redis time;
+# commands and pipelines are traced as spans
+redis_client = TracedRedis(connection_pool=redis.ConnectionPool(
+    host=redis_host, port=redis_port, db=0, decode_responses=True, connection_class=TimedRedisConnection))
+
+# User service setup
+USER_SERVICE_URL = os.environ.get('USER_SERVICE_URL', 'http://user_service:5001')
+USER_BATCH_MAX_IDS = int(os.environ.get('USER_BATCH_MAX_IDS', 1000))
+
+# Rows fetched per server-side cursor round trip by /products/export
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 1000))
+
+# Upper bound on operations accepted by /products/bulk
+BULK_MAX_OPERATIONS = int(os.environ.get('BULK_MAX_OPERATIONS', 10000))
+
+# Cache TTLs (seconds) for product entries, /products page indexes and
+# /products/search result indexes
+PRODUCT_CACHE_TTL = 120
+PRODUCT_LIST_CACHE_TTL = 60
+PRODUCT_SEARCH_CACHE_TTL = 30
+
+# Generation counters baked into every page and search index key; bumping
+# one orphans all of its cached indexes at once
+PRODUCT_LIST_GENERATION = "products:list:generation"
+PRODUCT_SEARCH_GENERATION = "products:search:generation"
+
+# Request tracing (common/tracing.py); registered before the other request
+# hooks so everything they log carries the trace ID
+tracer = Tracer('product_service', exporter_from_env())
+tracer.init_app(app)
 
 # Prometheus metrics
-REQUEST_COUNT = Counter('product_service_requests_total', 'Total requests', ['method', 'endpoint', 'status'])
-REQUEST_DURATION = Histogram('product_service_request_duration_seconds', 'Request duration')
+# request count and latency per method/route/status, plus per-request
+# db, Redis and upstream time, recorded by request hooks
+REQUEST_METRICS = RequestMetrics('product_service')
+REQUEST_METRICS.init_app(app)
 PRODUCT_COUNT = Counter('product_service_products_total', 'Total products created', ['operation'])
+UPSTREAM_METRICS = UpstreamMetrics('product_service')
+
+# Pooled keep-alive client for user-service
+user_service = ServiceClient('user_service', USER_SERVICE_URL, UPSTREAM_METRICS)
 
 # log_dir = '/app/logs'
 # os.mkdir(log_dir)
 
-# Structured logging
-class JSONFormatter(logging.Formatter):
-    def format(self, record):
-        log_entry = {
-            '@timestamp': datetime.datetime.utcnow().isoformat() + 'Z',
-            'timestamp': datetime.datetime.utcnow().isoformat() + 'Z',
-            'level': record.levelname,
-            'service': 'product_service',
-            'message': record.getMessage(),
-            'module': record.module,
-            'function': record.funcName,
-            'line': record.lineno
+# Structured logging: JSON lines written by a background thread
+log_pipeline = LogPipeline('product_service')
+logger = log_pipeline.logger
+# per-endpoint request summaries stand in for sampled-out lines; registered
+# first so requests rejected by later hooks are still counted
+request_summary = RequestSummary(logger)
+request_summary.init_app(app)
+
+logger.info("Product service started", extra={'endpoint': 'startup'})
+
+deadline.init_app(app, logger)
+
+# In-process L1 cache in front of Redis, kept coherent over pub/sub
+cache = TieredCache(redis_client, CacheMetrics('product_service'), logger)
+def fetch_creator_names(user_ids, endpoint):
+    """Resolve creator names for a set of user ids from the local creators table.
+
+    The table is fed by the user events stream (see creator_sync.py), so
+    normally no call leaves the service. Ids not in it yet, e.g. before
+    the backfill has run, are fetched from user-service and stored.
+    """
+    user_ids = set(user_ids)
+    if not user_ids:
+        return {}
+    names = dict(db.session.execute(
+        select(Creator.user_id, Creator.name).where(Creator.user_id.in_(user_ids))
+    ).all())
+    missing = user_ids - names.keys()
+    if missing:
+        fetched = fetch_remote_creator_names(missing, endpoint)
+        try:
+            upsert_creators({user_id: name for user_id, name in fetched.items() if name})
+        except Exception as e:
+            logger.warning("Failed to store creator names", extra={'endpoint': endpoint, 'error': str(e)})
+        names.update(fetched)
+    return names
+
+def fetch_remote_creator_names(user_ids, endpoint):
+    """Resolve creator names for a set of user ids via user-service /users/batch.
+
+    Issues one request per USER_BATCH_MAX_IDS distinct ids instead of one per
+    product, with up to UPSTREAM_FANOUT_CONCURRENCY of them in flight. Ids
+    that could not be resolved are simply absent from the result, so callers
+    render a null creator while user-service is down or its circuit is open.
+    """
+    user_ids = sorted(set(user_ids))
+    chunks = [user_ids[i:i + USER_BATCH_MAX_IDS] for i in range(0, len(user_ids), USER_BATCH_MAX_IDS)]
+
+    def lookup(chunk):
+        user_response = user_service.post('/users/batch', json={'ids': chunk})
+        if user_response.status_code != 200:
+            logger.warning("User batch lookup failed", extra={'endpoint': endpoint, 'status_code': user_response.status_code})
+            return []
+        return user_response.json().get('users', [])
+
+    names = {}
+    for chunk, result in zip(chunks, bounded_map(lookup, chunks)):
+        if isinstance(result, Exception):
+            logger.warning("Failed to fetch user info", extra={'endpoint': endpoint, 'user_count': len(chunk), 'error': str(result)})
+            continue
+        for user in result:
+            names[user['user_id']] = user.get('name')
+    return names
+
+def invalidate_product_caches(product_ids=(), count_deltas=None, reindex=True):
+    """Apply the cache side of a product write in one pipeline.
+
+    Deleted keys are broadcast so every worker drops its in-process copy.
+    ``count_deltas`` ({user_id: +n/-n}) adjusts the per-user product
+    counters in place. Cached /products pages only hold ordered ids, so
+    they go stale only when a write can change which products a page holds
+    or their order (create, delete, price change); ``reindex`` bumps the
+    list generation for those instead of deleting each page. Any write can
+    change what a search matches, so the search generation always moves.
+    """
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.incr(PRODUCT_SEARCH_GENERATION)
+    if reindex:
+        pipe.incr(PRODUCT_LIST_GENERATION)
+    if count_deltas:
+        count_keys = []
+        for user_id, delta in count_deltas.items():
+            if delta:
+                pipe.incrby(product_count_key(user_id), delta)
+                count_keys.append(product_count_key(user_id))
+        cache.notify(count_keys, pipe)
+    cache.invalidate([f"product:{product_id}" for product_id in product_ids], pipe=pipe)
+    pipe.execute()
+
+def invalidate_creator_products(user_ids):
+    """Drop cached products whose creator was renamed."""
+    with app.app_context():
+        product_ids = db.session.scalars(select(Product.id).where(Product.user_id.in_(user_ids))).all()
+    cache.invalidate([f"product:{product_id}" for product_id in product_ids])
+
+# Consume user created/renamed events into the local creators table
+creator_sync = CreatorSync(app, redis_client, logger, on_renamed=invalidate_creator_products)
+# Repair per-user product counters against Postgres
+count_reconciler = CountReconciler(app, redis_client, logger, cache)
+def serialize_product(product, creator_name):
+    return {
+        "id": product.id,
+        "name": product.name,
+        # Numeric comes back as Decimal; clients expect a JSON number
+        "price": float(product.price),
+        "description": product.description,
+        "user_id": product.user_id,
+        "creator": creator_name
+    }
+
+def cache_products(products, endpoint):
+    """Serialize products with creator names and store each under product:{id}."""
+    creator_names = fetch_creator_names([p.user_id for p in products], endpoint)
+    product_data = {p.id: serialize_product(p, creator_names.get(p.user_id)) for p in products}
+    if product_data:
+        cache.set_many({f"product:{product_id}": data for product_id, data in product_data.items()}, PRODUCT_CACHE_TTL)
+    return product_data
+
+def loader_context():
+    # a request's own context carries g (deadline, per-request db and
+    # upstream time); only background refreshes need a fresh one
+    return nullcontext() if has_app_context() else app.app_context()
+
+def load_product(product_id):
+    # runs on a cache miss, possibly in a background refresh thread
+    with loader_context():
+        product = db.session.get(Product, product_id)
+        if not product:
+            return None
+        creator_name = fetch_creator_names([product.user_id], '/product/<int:product_id>').get(product.user_id)
+        return serialize_product(product, creator_name)
+
+def load_page_index(page):
+    # runs on a cache miss, possibly in a background refresh thread
+    with loader_context():
+        products = page.query().all()
+        has_more = len(products) > page.limit
+        products = products[:page.limit]
+
+        # the page rows are already loaded, so warm their product entries too
+        cache_products(products, '/products')
+        return {
+            "ids": [p.id for p in products],
+            "next_cursor": page.next_cursor(products[-1]) if has_more else None,
+            "limit": page.limit
         }
 
-        if record.exc_info:
-            log_entry['exception'] = self.formatException(record.exc_info)
-            
-        # Add extra fields if present
-        if hasattr(record, 'product_id'):
-            log_entry['product_id'] = record.product_id
-        if hasattr(record, 'user_id'):
-            log_entry['user_id'] = record.user_id
-        if hasattr(record, 'endpoint'):
-            log_entry['endpoint'] = record.endpoint
-        if hasattr(record, 'status_code'):
-            log_entry['status_code'] = record.status_code
-            
-        return json.dumps(log_entry)
-
-# Set up logging
-
-
-logger = logging.getLogger('product_service')
-logger.setLevel(logging.INFO)
-
-# Remove any existing handlers to avoid duplicates
-for handler in logger.handlers[:]:
-    logger.removeHandler(handler)
-
-# Create rotating file handler (10MB per file, keep 5 files)
-# log_file = os.path.join(log_dir, 'app.log')
-# file_handler = logging.handlers.RotatingFileHandler(
-#     log_file, 
-#     maxBytes=10*1024*1024,  # 10MB
-#     backupCount=5
-# )
-
-# Create console handler with JSON formatter
-handler = logging.StreamHandler()
-handler.setFormatter(JSONFormatter())
-logger.addHandler(handler)
+def load_search_index(search):
+    # runs on a cache miss, possibly in a background refresh thread
+    with loader_context():
+        rows = search.query().all()
+        has_more = len(rows) > search.limit
+        rows = rows[:search.limit]
+        return {
+            "ids": [row.id for row in rows],
+            "next_cursor": search.next_cursor(rows[-1]) if has_more else None,
+            "limit": search.limit
+        }
 
-logger.info("Product service started", extra={'endpoint': 'startup'})
+def load_products_by_id(product_ids):
+    """Return products in the given order from per-product entries, loading misses in one query."""
+    cached = cache.get_many([f"product:{product_id}" for product_id in product_ids])
+    products = {product_id: cached[f"product:{product_id}"] for product_id in product_ids if f"product:{product_id}" in cached}
+    missing = [product_id for product_id in product_ids if product_id not in products]
+    if missing:
+        products.update(cache_products(Product.query.filter(Product.id.in_(missing)).all(), '/products'))
+    # ids deleted since the index was built are skipped
+    return [products[product_id] for product_id in product_ids if product_id in products]
 
 # endpoint to get a single product
 @app.route('/product/<int:product_id>')
 def get_product(product_id):
-    start_time = time.time()
-    logger.info(f"Get product request for product_id: {product_id}", extra={'endpoint': '/product/<int:product_id>', 'product_id': product_id})
+    logger.info("Get product request for product_id: %s", product_id, extra={'endpoint': '/product/<int:product_id>', 'product_id': product_id})
     
     try:
-        cache_key = f"product:{product_id}"
-        cached_product = redis_client.get(cache_key)
-        if cached_product:
-            logger.info("Product found in cache", extra={'endpoint': '/product/<int:product_id>', 'product_id': product_id, 'cached': True})
-            REQUEST_COUNT.labels('GET', '/product/<int:product_id>', '200').inc()
-            REQUEST_DURATION.observe(time.time() - start_time)
-            logger.info("Product retrieved from cache", extra={'endpoint': '/product/<int:product_id>', 'product_id': product_id, 'status_code': 200})
-            return jsonify({"product": json.loads(cached_product), "cached": True})
-
-        product = Product.query.get(product_id)
-        if not product:
+        # concurrent misses are rebuilt once; stale entries are served while refreshing
+        product_data, cached = cache.get_or_compute(f"product:{product_id}", lambda: load_product(product_id), PRODUCT_CACHE_TTL)
+        if product_data is None:
             logger.warning("Product not found", extra={'endpoint': '/product/<int:product_id>', 'product_id': product_id, 'status_code': 404})
-            REQUEST_COUNT.labels('GET', '/product/<int:product_id>', '404').inc()
-            REQUEST_DURATION.observe(time.time() - start_time)
             return jsonify({"error": "Product not found"}), 404
 
-        creator_name = None
-        try:
-            user_response = requests.get(f'http://user_service:5001/user/{product.user_id}', timeout=2)
-            if user_response.status_code == 200:
-                user_data = user_response.json()
-                creator_name = user_data.get('user', {}).get('name')
-        except Exception as e:
-            logger.warning("Failed to fetch user info", extra={'endpoint': '/product/<int:product_id>', 'product_id': product_id, 'user_id': product.user_id, 'error': str(e)})
-
-        product_data = {
-            "id": product.id,
-            "name": product.name,
-            "price": product.price,
-            "description": product.description,
-            "user_id": product.user_id,
-            "creator": creator_name
-        }
-        
-        redis_client.setex(cache_key, 120, json.dumps(product_data))
-        REQUEST_COUNT.labels('GET', '/product/<int:product_id>', '200').inc()
-        REQUEST_DURATION.observe(time.time() - start_time)
-        logger.info("Product retrieved from database", extra={'endpoint': '/product/<int:product_id>', 'product_id': product.id, 'user_id': product.user_id, 'status_code': 200})
-        return jsonify({"product": product_data, "cached": False})
+        logger.info("Product retrieved", extra={'endpoint': '/product/<int:product_id>', 'product_id': product_id, 'user_id': product_data["user_id"], 'status_code': 200, 'cached': cached})
+        return jsonify({"product": product_data, "cached": cached})
     except Exception as e:
         logger.error("Error retrieving product", extra={'endpoint': '/product/<int:product_id>', 'product_id': product_id, 'error': str(e)})
-        REQUEST_COUNT.labels('GET', '/product/<int:product_id>', '500').inc()
-        REQUEST_DURATION.observe(time.time() - start_time)
         return jsonify({"error": str(e)}), 500
 
-# get all products
+# list products, one keyset-paginated page at a time
 @app.route("/products", methods=["GET"])
 def get_products():
-    start_time = time.time()
-    logger.info("Get all products request", extra={'endpoint': '/products'})
-    
+    logger.info("Get products page request", extra={'endpoint': '/products'})
+
     try:
-        cache_key = "products:all"
-        cached_products = redis_client.get(cache_key)
-        if cached_products:
-            logger.info("Products list found in cache", extra={'endpoint': '/products', 'cached': True})
-            REQUEST_COUNT.labels('GET', '/products', '200').inc()
-            REQUEST_DURATION.observe(time.time() - start_time)
-            logger.info("Products retrieved from cache", extra={'endpoint': '/products', 'status_code': 200})
-            return jsonify(json.loads(cached_products))
-
-        products = Product.query.all()
-        logger.info(f"Retrieved {len(products)} products from database", extra={'endpoint': '/products', 'product_count': len(products)})
-        
-        products_list = []
-        
-        for p in products:
-            creator_name = None
-            try:
-                user_response = requests.get(f'http://user_service:5001/user/{p.user_id}', timeout=2)
-                if user_response.status_code == 200:
-                    user_data = user_response.json()
-                    creator_name = user_data.get('user', {}).get('name')
-            except Exception as e:
-                logger.warning("Failed to fetch user info for product", extra={'endpoint': '/products', 'product_id': p.id, 'user_id': p.user_id, 'error': str(e)})
-                
-            products_list.append({
-                "id": p.id,
-                "name": p.name,
-                "price": p.price,
-                "description": p.description,
-                "user_id": p.user_id,
-                "creator": creator_name
-            })
-        
-        redis_client.setex(cache_key, 60, json.dumps(products_list))
-        REQUEST_COUNT.labels('GET', '/products', '200').inc()
-        REQUEST_DURATION.observe(time.time() - start_time)
-        logger.info("Products retrieved successfully", extra={'endpoint': '/products', 'product_count': len(products_list), 'status_code': 200})
-        return jsonify(products_list)
+        try:
+            page = PageRequest.from_args(request.args)
+        except ValueError as e:
+            logger.warning("Invalid products page request", extra={'endpoint': '/products', 'error': str(e), 'status_code': 400})
+            return jsonify({"error": str(e)}), 400
+
+        # the page itself is an ordered id index; product bodies come from product:{id}
+        generation = redis_client.get(PRODUCT_LIST_GENERATION) or 0
+        index, cached = cache.get_or_compute(page.cache_key(generation), lambda: load_page_index(page), PRODUCT_LIST_CACHE_TTL)
+        products = load_products_by_id(index["ids"])
+        logger.info("Products page retrieved", extra={'endpoint': '/products', 'product_count': len(products), 'status_code': 200, 'cached': cached})
+        return jsonify({"products": products, "next_cursor": index["next_cursor"], "limit": index["limit"], "cached": cached})
     except Exception as e:
         logger.error("Error retrieving products", extra={'endpoint': '/products', 'error': str(e)})
-        REQUEST_COUNT.labels('GET', '/products', '500').inc()
-        REQUEST_DURATION.observe(time.time() - start_time)
         return jsonify({"error": str(e)}), 500
 
+# full-text product search, best match first
+@app.route("/products/search", methods=["GET"])
+def search_products():
+    logger.info("Search products request", extra={'endpoint': '/products/search'})
+
+    try:
+        try:
+            search = SearchRequest.from_args(request.args)
+        except ValueError as e:
+            logger.warning("Invalid product search request", extra={'endpoint': '/products/search', 'error': str(e), 'status_code': 400})
+            return jsonify({"error": str(e)}), 400
+
+        # like /products, results are cached as an ordered id index
+        generation = redis_client.get(PRODUCT_SEARCH_GENERATION) or 0
+        index, cached = cache.get_or_compute(search.cache_key(generation), lambda: load_search_index(search), PRODUCT_SEARCH_CACHE_TTL)
+        products = load_products_by_id(index["ids"])
+        logger.info("Product search completed", extra={'endpoint': '/products/search', 'product_count': len(products), 'status_code': 200, 'cached': cached})
+        return jsonify({"products": products, "next_cursor": index["next_cursor"], "limit": index["limit"], "cached": cached})
+    except Exception as e:
+        logger.error("Error searching products", extra={'endpoint': '/products/search', 'error': str(e)})
+        return jsonify({"error": str(e)}), 500
+
+# stream the full catalog as newline-delimited JSON
+@app.route("/products/export")
+def export_products():
+    start_time = time.time()
+    logger.info("Export products request", extra={'endpoint': '/products/export'})
+
+    def generate():
+        exported = 0
+        try:
+            # yield_per streams rows through a server-side cursor, so only one
+            # chunk of products is ever held in memory
+            rows = Product.query.order_by(Product.id).yield_per(EXPORT_CHUNK_SIZE)
+            chunk = []
+            for product in rows:
+                chunk.append(product)
+                if len(chunk) >= EXPORT_CHUNK_SIZE:
+                    yield export_chunk(chunk)
+                    exported += len(chunk)
+                    chunk = []
+            if chunk:
+                yield export_chunk(chunk)
+                exported += len(chunk)
+            logger.info("Products exported", extra={'endpoint': '/products/export', 'product_count': exported, 'duration': time.time() - start_time})
+        except Exception as e:
+            # headers are already sent, so the client sees a truncated stream
+            logger.error("Error exporting products", extra={'endpoint': '/products/export', 'product_count': exported, 'error': str(e)})
+            raise
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def export_chunk(products):
+    creator_names = fetch_creator_names([p.user_id for p in products], '/products/export')
+    return ''.join(json.dumps(serialize_product(p, creator_names.get(p.user_id))) + '\n' for p in products)
+
 @app.route("/products/count")
 def count_products():
-    start_time = time.time()
     user_id = request.args.get("user_id", type=int)
-    logger.info(f"Get product count request for user_id: {user_id}", extra={'endpoint': '/products/count', 'user_id': user_id})
+    logger.info("Get product count request for user_id: %s", user_id, extra={'endpoint': '/products/count', 'user_id': user_id})
     
     try:
         if user_id is None:
             logger.warning("Product count request missing user_id", extra={'endpoint': '/products/count', 'status_code': 400})
-            REQUEST_COUNT.labels('GET', '/products/count', '400').inc()
-            REQUEST_DURATION.observe(time.time() - start_time)
             return jsonify({"error": "user_id required"}), 400
 
-        cache_key = f"products:count:user:{user_id}"
+        # maintained by INCRBY on writes and repaired by the reconciler
+        cache_key = product_count_key(user_id)
         cached_count = redis_client.get(cache_key)
         if cached_count is not None:
-            logger.info("Product count found in cache", extra={'endpoint': '/products/count', 'user_id': user_id, 'count': int(cached_count), 'cached': True})
-            REQUEST_COUNT.labels('GET', '/products/count', '200').inc()
-            REQUEST_DURATION.observe(time.time() - start_time)
+            cache.record_lookups(hits=[cache_key])
+            logger.info("Product count retrieved from cache", extra={'endpoint': '/products/count', 'user_id': user_id, 'count': int(cached_count), 'status_code': 200, 'cached': True})
             return jsonify({"count": int(cached_count), "cached": True})
 
+        cache.record_lookups(misses=[cache_key])
         count = Product.query.filter_by(user_id=user_id).count()
-        redis_client.setex(cache_key, 30, count)
-        REQUEST_COUNT.labels('GET', '/products/count', '200').inc()
-        REQUEST_DURATION.observe(time.time() - start_time)
+        if count:
+            # NX: never overwrite a counter a concurrent write just created
+            redis_client.set(cache_key, count, nx=True)
         logger.info("Product count retrieved", extra={'endpoint': '/products/count', 'user_id': user_id, 'count': count, 'status_code': 200})
         return jsonify({"count": count, "cached": False})
     except Exception as e:
         logger.error("Error counting products", extra={'endpoint': '/products/count', 'user_id': user_id, 'error': str(e)})
-        REQUEST_COUNT.labels('GET', '/products/count', '500').inc()
-        REQUEST_DURATION.observe(time.time() - start_time)
         return jsonify({"error": str(e)}), 500
 
 # create products
 @app.route("/products", methods=["POST"])
 def create_product():
-    start_time = time.time()
     try:
         data = request.get_json()
         logger.info("Create product request", extra={'endpoint': '/products', 'user_id': data.get('user_id') if data else None, 'product_name': data.get('name') if data else None})
@@ -242,106 +399,133 @@ def create_product():
             user_id = int(user_id) if user_id is not None else None
         except ValueError:
             logger.warning("Invalid user_id format", extra={'endpoint': '/products', 'user_id': user_id, 'status_code': 400})
-            REQUEST_COUNT.labels('POST', '/products', '400').inc()
-            REQUEST_DURATION.observe(time.time() - start_time)
             return jsonify({'error': 'Invalid user_id'}), 400
 
         if not name or price is None or user_id is None:
             logger.warning("Missing required fields for product creation", extra={'endpoint': '/products', 'name': name, 'price': price, 'user_id': user_id, 'status_code': 400})
-            REQUEST_COUNT.labels('POST', '/products', '400').inc()
-            REQUEST_DURATION.observe(time.time() - start_time)
             return jsonify({'error': 'Name, price, and user_id are required'}), 400
 
-        product = Product(name=name, price=float(price), description=description, user_id=user_id)
+        try:
+            price = parse_price(price)
+        except ValueError as e:
+            logger.warning("Invalid price", extra={'endpoint': '/products', 'price': data.get("price"), 'status_code': 400})
+            return jsonify({'error': str(e)}), 400
+
+        product = Product(name=name, price=price, description=description, user_id=user_id)
         db.session.add(product)
         db.session.commit()
         
         PRODUCT_COUNT.labels('create').inc()
         
-        creator_name = None
-        try:
-            user_response = requests.get(f'http://user_service:5001/user/{user_id}', timeout=2)
-            if user_response.status_code == 200:
-                user_data = user_response.json()
-                creator_name = user_data.get('user', {}).get('name')
-        except Exception as e:
-            logger.warning("Failed to fetch user info for new product", extra={'endpoint': '/products', 'user_id': user_id, 'error': str(e)})
+        creator_name = fetch_creator_names([user_id], '/products').get(user_id)
         
-        redis_client.delete("products:all")
-        redis_client.delete(f"products:count:user:{user_id}")
+        invalidate_product_caches(count_deltas={user_id: 1})
         
-        REQUEST_COUNT.labels('POST', '/products', '201').inc()
-        REQUEST_DURATION.observe(time.time() - start_time)
         logger.info("Product created successfully", extra={'endpoint': '/products', 'product_id': product.id, 'user_id': user_id, 'product_name': product.name, 'status_code': 201})
-        return jsonify({
-            "id": product.id,
-            "name": product.name,
-            "price": product.price,
-            "description": product.description,
-            "user_id": product.user_id,
-            "creator": creator_name
-        }), 201
+        return jsonify(serialize_product(product, creator_name)), 201
     except Exception as e:
         db.session.rollback()
         logger.error("Error creating product", extra={'endpoint': '/products', 'user_id': data.get('user_id') if data else None, 'error': str(e)})
-        REQUEST_COUNT.labels('POST', '/products', '500').inc()
-        REQUEST_DURATION.observe(time.time() - start_time)
+        return jsonify({'error': str(e)}), 500
+
+# apply many create/update/delete operations in one transaction
+@app.route("/products/bulk", methods=["POST"])
+def bulk_products():
+    try:
+        data = request.get_json(silent=True) or {}
+        operations = data.get("operations")
+        if not isinstance(operations, list) or not operations:
+            logger.warning("Bulk request missing operations", extra={'endpoint': '/products/bulk', 'status_code': 400})
+            return jsonify({'error': 'operations must be a non-empty list'}), 400
+        if len(operations) > BULK_MAX_OPERATIONS:
+            logger.warning("Bulk request too large", extra={'endpoint': '/products/bulk', 'operation_count': len(operations), 'status_code': 400})
+            return jsonify({'error': f'At most {BULK_MAX_OPERATIONS} operations per request'}), 400
+
+        logger.info("Bulk product request", extra={'endpoint': '/products/bulk', 'operation_count': len(operations)})
+        result = apply_bulk_operations(operations)
+        db.session.commit()
+
+        PRODUCT_COUNT.labels('create').inc(len(result.created))
+        PRODUCT_COUNT.labels('update').inc(len(result.updated_ids))
+        PRODUCT_COUNT.labels('delete').inc(len(result.deleted_ids))
+
+        creator_names = fetch_creator_names([row["user_id"] for _, _, row in result.created], '/products/bulk')
+        for index, product_id, row in result.created:
+            result.items[index] = {"index": index, "op": "create", "status": 201, "id": product_id,
+                                   # price is parsed to Decimal; answer a JSON number like serialize_product
+                                   "product": {"id": product_id, **row, "price": float(row["price"]),
+                                               "creator": creator_names.get(row["user_id"])}}
+        for index, product_id in result.updated_ids:
+            result.items[index] = {"index": index, "op": "update", "status": 200, "id": product_id}
+        for index, product_id in result.deleted_ids:
+            result.items[index] = {"index": index, "op": "delete", "status": 200, "id": product_id}
+
+        changed_ids = [product_id for _, product_id in result.updated_ids + result.deleted_ids]
+        if result.created or changed_ids:
+            invalidate_product_caches(product_ids=changed_ids, count_deltas=result.count_deltas, reindex=result.reindex)
+
+        logger.info("Bulk product request applied", extra={'endpoint': '/products/bulk', 'created': len(result.created), 'updated': len(result.updated_ids), 'deleted': len(result.deleted_ids), 'status_code': 200})
+        return jsonify({
+            "results": result.items,
+            "created": len(result.created),
+            "updated": len(result.updated_ids),
+            "deleted": len(result.deleted_ids),
+            "failed": sum(1 for item in result.items if item["status"] >= 400)
+        })
+    except Exception as e:
+        db.session.rollback()
+        logger.error("Error applying bulk product request", extra={'endpoint': '/products/bulk', 'error': str(e)})
         return jsonify({'error': str(e)}), 500
 
 # update product
 @app.route("/products/<int:product_id>", methods=["PUT"])
 def update_product(product_id):
-    start_time = time.time()
-    logger.info(f"Update product request for product_id: {product_id}", extra={'endpoint': '/products/<int:product_id>', 'product_id': product_id})
+    logger.info("Update product request for product_id: %s", product_id, extra={'endpoint': '/products/<int:product_id>', 'product_id': product_id})
     
     try:
         product = Product.query.get_or_404(product_id)
         data = request.get_json()
         logger.info("Updating product", extra={'endpoint': '/products/<int:product_id>', 'product_id': product_id, 'user_id': product.user_id})
 
+        old_price = product.price
+        old_text = (product.name, product.description)
+        if "price" in data:
+            try:
+                new_price = parse_price(data["price"])
+            except ValueError as e:
+                logger.warning("Invalid price", extra={'endpoint': '/products/<int:product_id>', 'product_id': product_id, 'price': data["price"], 'status_code': 400})
+                return jsonify({'error': str(e)}), 400
+            product.price = new_price
         product.name = data.get("name", product.name)
-        product.price = data.get("price", product.price)
         product.description = data.get("description", product.description)
 
         db.session.commit()
         PRODUCT_COUNT.labels('update').inc()
         
-        creator_name = None
-        try:
-            user_response = requests.get(f'http://user_service:5001/user/{product.user_id}', timeout=2)
-            if user_response.status_code == 200:
-                user_data = user_response.json()
-                creator_name = user_data.get('user', {}).get('name')
-        except Exception as e:
-            logger.warning("Failed to fetch user info for updated product", extra={'endpoint': '/products/<int:product_id>', 'product_id': product_id, 'user_id': product.user_id, 'error': str(e)})
-        
-        redis_client.delete(f"product:{product_id}")
-        redis_client.delete("products:all")
-        redis_client.delete(f"products:count:user:{product.user_id}")
+        creator_name = fetch_creator_names([product.user_id], '/products/<int:product_id>').get(product.user_id)
+
+        # rewrite the one cached entry in place; page indexes only need a new
+        # generation when the price (a sort and filter key) changed, search
+        # indexes when the searchable text did
+        pipe = redis_client.pipeline(transaction=False)
+        if product.price != old_price:
+            pipe.incr(PRODUCT_LIST_GENERATION)
+        if (product.name, product.description) != old_text:
+            pipe.incr(PRODUCT_SEARCH_GENERATION)
+        cache.replace(f"product:{product_id}", serialize_product(product, creator_name), PRODUCT_CACHE_TTL, pipe=pipe)
+        pipe.execute()
         
-        REQUEST_COUNT.labels('PUT', '/products/<int:product_id>', '200').inc()
-        REQUEST_DURATION.observe(time.time() - start_time)
         logger.info("Product updated successfully", extra={'endpoint': '/products/<int:product_id>', 'product_id': product.id, 'user_id': product.user_id, 'status_code': 200})
-        return jsonify({
-            "id": product.id,
-            "name": product.name,
-            "price": product.price,
-            "description": product.description,
-            "user_id": product.user_id,
-            "creator": creator_name
-        })
+        return jsonify(serialize_product(product, creator_name))
     except Exception as e:
         db.session.rollback()
         logger.error("Error updating product", extra={'endpoint': '/products/<int:product_id>', 'product_id': product_id, 'error': str(e)})
-        REQUEST_COUNT.labels('PUT', '/products/<int:product_id>', '500').inc()
-        REQUEST_DURATION.observe(time.time() - start_time)
         return jsonify({'error': str(e)}), 500
 
 # delete product
 @app.route("/products/<int:product_id>", methods=["DELETE"])
 def delete_product(product_id):
-    start_time = time.time()
-    logger.info(f"Delete product request for product_id: {product_id}", extra={'endpoint': '/products/<int:product_id>', 'product_id': product_id})
+    logger.info("Delete product request for product_id: %s", product_id, extra={'endpoint': '/products/<int:product_id>', 'product_id': product_id})
     
     try:
         product = Product.query.get_or_404(product_id)
@@ -352,21 +536,32 @@ def delete_product(product_id):
         db.session.commit()
         PRODUCT_COUNT.labels('delete').inc()
         
-        redis_client.delete(f"product:{product_id}")
-        redis_client.delete("products:all")
-        redis_client.delete(f"products:count:user:{user_id}")
+        invalidate_product_caches(product_ids=[product_id], count_deltas={user_id: -1})
         
-        REQUEST_COUNT.labels('DELETE', '/products/<int:product_id>', '200').inc()
-        REQUEST_DURATION.observe(time.time() - start_time)
         logger.info("Product deleted successfully", extra={'endpoint': '/products/<int:product_id>', 'product_id': product_id, 'user_id': user_id, 'status_code': 200})
         return jsonify({"message": "Product deleted"})
     except Exception as e:
         db.session.rollback()
         logger.error("Error deleting product", extra={'endpoint': '/products/<int:product_id>', 'product_id': product_id, 'error': str(e)})
-        REQUEST_COUNT.labels('DELETE', '/products/<int:product_id>', '500').inc()
-        REQUEST_DURATION.observe(time.time() - start_time)
         return jsonify({'error': str(e)}), 500
 
+# populate creators for every existing product owner: flask backfill-creators
+@app.cli.command("backfill-creators")
+def backfill_creators():
+    user_ids = db.session.scalars(select(Product.user_id).distinct()).all()
+    names = fetch_remote_creator_names(user_ids, 'backfill-creators')
+    resolved = sorted(names)
+    for i in range(0, len(resolved), USER_BATCH_MAX_IDS):
+        upsert_creators({user_id: names[user_id] for user_id in resolved[i:i + USER_BATCH_MAX_IDS]})
+    logger.info("Creators backfilled", extra={'endpoint': 'backfill-creators', 'user_count': len(names), 'missing': len(user_ids) - len(names)})
+    print(f"Backfilled {len(names)} of {len(user_ids)} creators")
+
+# repair per-user product counters now: flask reconcile-product-counts
+@app.cli.command("reconcile-product-counts")
+def reconcile_product_counts_command():
+    fixed = reconcile_product_counts(redis_client, cache)
+    print(f"Repaired {fixed} product counters")
+
 # health check
 @app.route("/health")
 def health():
@@ -377,18 +572,70 @@ def health():
 @app.route('/metrics')
 def metrics():
     logger.info("Metrics endpoint accessed", extra={'endpoint': '/metrics'})
-    resp = generate_latest()
+    # merged across gunicorn workers in multiprocess mode
+    resp = metrics_output()
     return resp, 200, {'Content-Type': CONTENT_TYPE_LATEST}
 
-if __name__ == "__main__":
+def _unversioned_revision(inspector):
+    """Revision matching a schema that db.create_all() made before startup ran migrations."""
+    if 'search_vector' in {column['name'] for column in inspector.get_columns('products')}:
+        return 'head'
+    if inspector.has_table('creators'):
+        return '4f1c2b9d7e10'
+    return '78b40bc077d3'
+
+def migrate_db():
+    """Create a fresh schema, or bring an existing one up to date with the migrations."""
+    inspector = inspect(db.engine)
+    if not inspector.has_table('products'):
+        # trigram index on products.name
+        db.session.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        db.session.commit()
+        db.create_all()
+        stamp(revision='head')
+        return
+    if not inspector.has_table('alembic_version'):
+        stamp(revision=_unversioned_revision(inspector))
+    upgrade()
+
+def init_db():
     with app.app_context():
         for _ in range(10):
             try:
-                db.create_all()
+                migrate_db()
                 break
             except OperationalError:
+                db.session.rollback()
                 logger.warning("Database unavailable, retrying in 2 seconds...")
                 print("Database unavailable, retrying in 2 seconds...")
                 time.sleep(2)
+
+def start_background_workers():
+    request_summary.start()
+    cache.start_listener()
+    creator_sync.start()
+    count_reconciler.start()
+
+# gunicorn hook (common/gunicorn_conf.py): the app is imported once in the
+# master, so connections and threads are recreated in every worker
+def post_fork():
+    log_pipeline.after_fork()
+    with app.app_context():
+        db.engine.dispose(close=False)
+        report_pool_size(db.engine, DB_POOL_METRICS)
+    redis_client.connection_pool.reset()
+    user_service.reset()
+    start_background_workers()
+
+# gunicorn hook: leave the event consumer group, flush buffered log lines and traces before the worker exits
+def worker_exit():
+    request_summary.stop()
+    creator_sync.stop()
+    tracer.close()
+    log_pipeline.stop()
+
+if __name__ == "__main__":
+    init_db()
+    start_background_workers()
     logger.info("Starting product service", extra={'port': 5002})
-    app.run(host='0.0.0.0', port=5002, debug=True)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=5002, debug=True)
@@ -0,0 +1,139 @@
+from collections import Counter
+
+from sqlalchemy import delete, insert, select, update
+
+from model import db, Product, parse_price
+
+UPDATABLE_FIELDS = ('name', 'price', 'description')
+
+
+class BulkResult:
+    """Outcome of one /products/bulk request."""
+
+    def __init__(self, size):
+        self.items = [None] * size
+        self.created = []
+        self.updated_ids = []
+        self.deleted_ids = []
+        # per-user change in product count
+        self.count_deltas = Counter()
+        # True when list membership or order may have changed
+        self.reindex = False
+
+    def reject(self, index, op, status, error, product_id=None):
+        self.items[index] = {"index": index, "op": op, "status": status, "id": product_id, "error": error}
+
+
+def apply_bulk_operations(operations):
+    """Validate and apply create/update/delete operations in one transaction.
+
+    Invalid operations are reported per item and skipped; every valid one is
+    written with a single insert-many, update-many and delete statement. The
+    caller owns the transaction and must commit or roll back.
+    """
+    result = BulkResult(len(operations))
+    creates, updates, deletes = [], [], []
+
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict):
+            result.reject(index, None, 400, "Operation must be an object")
+            continue
+        op = operation.get("op")
+        if op == "create":
+            row, error = _parse_create(operation)
+            if error:
+                result.reject(index, op, 400, error)
+            else:
+                creates.append((index, row))
+        elif op in ("update", "delete"):
+            try:
+                product_id = int(operation.get("id"))
+            except (TypeError, ValueError):
+                result.reject(index, op, 400, "Invalid id")
+                continue
+            if op == "update":
+                values, error = _parse_update(operation)
+                if error:
+                    result.reject(index, op, 400, error, product_id)
+                else:
+                    updates.append((index, product_id, values))
+            else:
+                deletes.append((index, product_id))
+        else:
+            result.reject(index, op, 400, "op must be one of create, update, delete")
+
+    # one lookup for every id touched by an update or delete
+    target_ids = {product_id for _, product_id, _ in updates} | {product_id for _, product_id in deletes}
+    owners = {}
+    if target_ids:
+        owners = dict(db.session.execute(
+            select(Product.id, Product.user_id).where(Product.id.in_(target_ids))
+        ).all())
+
+    if creates:
+        rows = [row for _, row in creates]
+        new_ids = db.session.scalars(
+            insert(Product).returning(Product.id, sort_by_parameter_order=True), rows
+        ).all()
+        for (index, row), product_id in zip(creates, new_ids):
+            result.created.append((index, product_id, row))
+            result.count_deltas[row["user_id"]] += 1
+
+    deleted = set()
+    update_rows = []
+    for index, product_id, values in updates:
+        if product_id not in owners:
+            result.reject(index, "update", 404, "Product not found", product_id)
+            continue
+        update_rows.append({"id": product_id, **values})
+        if "price" in values:
+            result.reindex = True
+        result.updated_ids.append((index, product_id))
+    if update_rows:
+        # rows with the same key set are batched into one executemany
+        db.session.execute(update(Product), update_rows)
+
+    for index, product_id in deletes:
+        if product_id not in owners or product_id in deleted:
+            result.reject(index, "delete", 404, "Product not found", product_id)
+            continue
+        deleted.add(product_id)
+        result.deleted_ids.append((index, product_id))
+        result.count_deltas[owners[product_id]] -= 1
+    if result.created or deleted:
+        result.reindex = True
+    if deleted:
+        db.session.execute(delete(Product).where(Product.id.in_(deleted)), execution_options={"synchronize_session": False})
+
+    return result
+
+
+def _parse_create(operation):
+    name = operation.get("name")
+    price = operation.get("price")
+    user_id = operation.get("user_id")
+    if not name or price is None or user_id is None:
+        return None, "Name, price, and user_id are required"
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None, "Invalid user_id"
+    try:
+        price = parse_price(price)
+    except ValueError as e:
+        return None, str(e)
+    return {"name": name, "price": price, "description": operation.get("description"), "user_id": user_id}, None
+
+
+def _parse_update(operation):
+    values = {field: operation[field] for field in UPDATABLE_FIELDS if field in operation}
+    if not values:
+        return None, f"update needs at least one of {', '.join(UPDATABLE_FIELDS)}"
+    if "name" in values and not values["name"]:
+        return None, "Name cannot be empty"
+    if "price" in values:
+        try:
+            values["price"] = parse_price(values["price"])
+        except ValueError as e:
+            return None, str(e)
+    return values, None
@@ -0,0 +1,106 @@
+"""Periodic repair of the per-user product counters in Redis.
+
+Counters are adjusted with INCRBY on every write, so they can drift when a
+write commits but the Redis call fails (or the other way round). Every
+COUNT_RECONCILE_INTERVAL seconds one worker, elected with a Redis lock,
+compares them to a GROUP BY user_id over products and rewrites the ones
+that differ.
+
+Counters are read before the GROUP BY and each repair is a compare-and-set
+against the value read, so a write whose INCRBY lands while the
+reconciler runs makes it skip that counter (until the next run) instead of
+being overwritten with an older count.
+"""
+import os
+import threading
+import time
+
+from prometheus_client import Counter
+from sqlalchemy import func, select
+
+from common.product_counts import product_count_key
+from model import db, Product
+
+COUNT_RECONCILE_INTERVAL = int(os.environ.get('COUNT_RECONCILE_INTERVAL', 300))
+RECONCILE_LOCK = "lock:products:count:reconcile"
+
+# set (or delete, for 0) the counter only if it still holds the value read
+# before the GROUP BY; '' stands for a missing key
+_REPAIR_COUNTER = """
+if (redis.call('GET', KEYS[1]) or '') ~= ARGV[1] then
+    return 0
+end
+if ARGV[2] == '0' then
+    redis.call('DEL', KEYS[1])
+else
+    redis.call('SET', KEYS[1], ARGV[2])
+end
+return 1
+"""
+
+COUNT_DRIFT = Counter('product_service_product_count_drift_total', 'Product counters repaired by reconciliation')
+
+
+def reconcile_product_counts(redis_client, cache=None):
+    """Rewrite every counter that disagrees with Postgres; return how many were fixed.
+
+    Rewritten keys are announced through ``cache`` so user-service workers
+    drop their in-process copies.
+    """
+    # counters first: an INCRBY after this read is seen by the compare-and-set
+    observed = {}
+    names = list(redis_client.scan_iter(match=product_count_key('*'), count=1000))
+    for i in range(0, len(names), 1000):
+        chunk = names[i:i + 1000]
+        observed.update(zip(chunk, redis_client.mget(chunk)))
+
+    actual = dict(db.session.execute(
+        select(Product.user_id, func.count()).group_by(Product.user_id)
+    ).all())
+    expected = {key: 0 for key in observed}
+    expected.update((product_count_key(user_id), count) for user_id, count in actual.items())
+
+    drifted = [key for key, count in expected.items() if int(observed.get(key) or 0) != count]
+    repair = redis_client.register_script(_REPAIR_COUNTER)
+    fixed = 0
+    for i in range(0, len(drifted), 1000):
+        chunk = drifted[i:i + 1000]
+        pipe = redis_client.pipeline(transaction=False)
+        for key in chunk:
+            repair(keys=[key], args=[observed.get(key) or '', expected[key]], client=pipe)
+        changed = [key for key, applied in zip(chunk, pipe.execute()) if applied]
+        if changed:
+            if cache is not None:
+                pipe = redis_client.pipeline(transaction=False)
+                cache.notify(changed, pipe)
+                pipe.execute()
+            fixed += len(changed)
+    COUNT_DRIFT.inc(fixed)
+    return fixed
+
+
+class CountReconciler:
+    def __init__(self, app, redis_client, logger, cache=None):
+        self.app = app
+        self.redis = redis_client
+        self.logger = logger
+        self.cache = cache
+        self._thread = None
+
+    def start(self):
+        """Start (or restart, e.g. after fork) the reconciliation thread."""
+        self._thread = threading.Thread(target=self._run, name='count-reconciler', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                # the lock outlives the run so only one worker reconciles per interval
+                if self.redis.set(RECONCILE_LOCK, os.getpid(), nx=True, ex=COUNT_RECONCILE_INTERVAL):
+                    with self.app.app_context():
+                        fixed = reconcile_product_counts(self.redis, self.cache)
+                    if fixed:
+                        self.logger.warning("Product counters repaired", extra={'endpoint': 'count_reconciler', 'count': fixed})
+            except Exception as e:
+                self.logger.warning("Product count reconciliation failed", extra={'endpoint': 'count_reconciler', 'error': str(e)})
+            time.sleep(COUNT_RECONCILE_INTERVAL)
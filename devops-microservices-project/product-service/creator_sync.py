@@ -0,0 +1,162 @@
+"""Keeps the local creators table in sync with user-service events.
+
+A CreatorSync thread reads the user events stream through a Redis consumer
+group, so every worker and replica shares the work and each event is
+applied once. Events are upserted into creators in batches and
+acknowledged only after the commit. Entries left pending by a crashed
+consumer are reclaimed after CLAIM_IDLE_MS.
+
+Consumers are named per process, so each one leaves the group when its
+worker exits (``stop``), and whoever reclaims stale entries also deletes
+consumers idle for CLAIM_IDLE_MS with nothing pending (workers that were
+killed). Otherwise recycled workers would pile up in the group.
+"""
+import datetime
+import os
+import socket
+import threading
+import time
+
+from prometheus_client import Counter, Gauge
+from redis.exceptions import ResponseError
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from common.user_events import USER_EVENTS_STREAM, USER_RENAMED
+from model import db, Creator
+
+CONSUMER_GROUP = os.environ.get('USER_EVENTS_GROUP', 'product_service')
+READ_COUNT = int(os.environ.get('USER_EVENTS_READ_COUNT', 100))
+BLOCK_MS = 5000
+CLAIM_IDLE_MS = 60000
+
+EVENTS_PROCESSED = Counter('product_service_user_events_processed_total', 'User events applied to creators', ['type'])
+# every worker reads the same group-wide values, so take the max rather than the sum
+EVENTS_LAG = Gauge('product_service_user_events_lag', 'Stream entries not yet delivered to the consumer group',
+                   multiprocess_mode='livemax')
+EVENTS_PENDING = Gauge('product_service_user_events_pending', 'Delivered but unacknowledged stream entries',
+                       multiprocess_mode='livemax')
+
+
+def upsert_creators(names):
+    """Insert or rename creators from a {user_id: name} mapping in one statement."""
+    if not names:
+        return
+    now = datetime.datetime.utcnow()
+    stmt = pg_insert(Creator).values([
+        {'user_id': user_id, 'name': name, 'updated_at': now} for user_id, name in names.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Creator.user_id],
+        set_={'name': stmt.excluded.name, 'updated_at': stmt.excluded.updated_at})
+    # own connection and transaction, independent of the request session
+    with db.engine.begin() as conn:
+        conn.execute(stmt)
+
+
+class CreatorSync:
+    def __init__(self, app, redis_client, logger, on_renamed=None):
+        self.app = app
+        self.redis = redis_client
+        self.logger = logger
+        self.on_renamed = on_renamed
+        self.consumer = f"{socket.gethostname()}-{os.getpid()}"
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """Start (or restart, e.g. after fork) the consumer thread."""
+        self.consumer = f"{socket.gethostname()}-{os.getpid()}"
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='creator-sync', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop consuming and leave the group, unless entries are still pending for us."""
+        self._stop.set()
+        if self._thread is None:
+            return
+        # a blocked XREADGROUP returns within BLOCK_MS; entries it read are applied and acked
+        self._thread.join(BLOCK_MS / 1000 + 1)
+        if self._thread.is_alive():
+            return
+        try:
+            # deleting a consumer drops its pending entries; leave those to _claim_stale
+            if not self.redis.xpending_range(USER_EVENTS_STREAM, CONSUMER_GROUP, '-', '+', 1, consumername=self.consumer):
+                self.redis.xgroup_delconsumer(USER_EVENTS_STREAM, CONSUMER_GROUP, self.consumer)
+        except Exception as e:
+            self.logger.warning("Could not leave the user event consumer group", extra={'endpoint': 'creator_sync', 'error': str(e)})
+
+    def _run(self):
+        # '0' first re-reads entries delivered to us before a restart
+        last_id = '0'
+        last_claim = 0.0
+        group_ready = False
+        while not self._stop.is_set():
+            try:
+                if not group_ready:
+                    self._ensure_group()
+                    group_ready = True
+                if time.monotonic() - last_claim > CLAIM_IDLE_MS / 1000:
+                    self._claim_stale()
+                    last_claim = time.monotonic()
+
+                response = self.redis.xreadgroup(
+                    CONSUMER_GROUP, self.consumer, {USER_EVENTS_STREAM: last_id},
+                    count=READ_COUNT, block=None if last_id == '0' else BLOCK_MS)
+                entries = response[0][1] if response else []
+                if entries:
+                    self._apply(entries)
+                elif last_id == '0':
+                    last_id = '>'
+                self._update_lag()
+            except Exception as e:
+                self.logger.warning("User event consumer error", extra={'endpoint': 'creator_sync', 'error': str(e)})
+                # the stream or group may have been deleted
+                group_ready = False
+                self._stop.wait(1)
+
+    def _ensure_group(self):
+        try:
+            self.redis.xgroup_create(USER_EVENTS_STREAM, CONSUMER_GROUP, id='0', mkstream=True)
+        except ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    def _claim_stale(self):
+        _, entries, *_ = self.redis.xautoclaim(
+            USER_EVENTS_STREAM, CONSUMER_GROUP, self.consumer, CLAIM_IDLE_MS, start_id='0-0', count=READ_COUNT)
+        if entries:
+            self._apply(entries)
+
+        # consumers of workers that exited without leaving the group
+        for consumer in self.redis.xinfo_consumers(USER_EVENTS_STREAM, CONSUMER_GROUP):
+            if (consumer['name'] != self.consumer and not consumer.get('pending')
+                    and consumer.get('idle', 0) >= CLAIM_IDLE_MS):
+                self.redis.xgroup_delconsumer(USER_EVENTS_STREAM, CONSUMER_GROUP, consumer['name'])
+
+    def _apply(self, entries):
+        names = {}
+        renamed = set()
+        for _, fields in entries:
+            # trimmed entries come back with no fields
+            if not fields:
+                continue
+            user_id = int(fields['user_id'])
+            names[user_id] = fields['name']
+            if fields.get('type') == USER_RENAMED:
+                renamed.add(user_id)
+            EVENTS_PROCESSED.labels(fields.get('type', 'unknown')).inc()
+
+        with self.app.app_context():
+            upsert_creators(names)
+        self.redis.xack(USER_EVENTS_STREAM, CONSUMER_GROUP, *[entry_id for entry_id, _ in entries])
+        if renamed and self.on_renamed:
+            self.on_renamed(renamed)
+
+    def _update_lag(self):
+        for group in self.redis.xinfo_groups(USER_EVENTS_STREAM):
+            if group.get('name') == CONSUMER_GROUP:
+                EVENTS_PENDING.set(group.get('pending') or 0)
+                # 'lag' is reported by Redis 7+
+                if group.get('lag') is not None:
+                    EVENTS_LAG.set(group['lag'])
@@ -11,7 +11,8 @@ config = context.config
 
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
-fileConfig(config.config_file_name)
+# keep the services' own loggers enabled when migrations run at startup
+fileConfig(config.config_file_name, disable_existing_loggers=False)
 logger = logging.getLogger('alembic.env')
 
 target_metadata = db.metadata
@@ -46,10 +47,10 @@ target_db = current_app.extensions['migrate'].db
 # ... etc.
 
 
-# def get_metadata():
-#     if hasattr(target_db, 'metadatas'):
-#         return target_db.metadatas[None]
-#     return target_db.metadata
+def get_metadata():
+    if hasattr(target_db, 'metadatas'):
+        return target_db.metadatas[None]
+    return target_db.metadata
 
 
 def run_migrations_offline():
@@ -66,7 +67,7 @@ def run_migrations_offline():
     """
     url = config.get_main_option("sqlalchemy.url")
     context.configure(
-        url=url, target_metadata=target_metadata(), literal_binds=True
+        url=url, target_metadata=get_metadata(), literal_binds=True
     )
 
     with context.begin_transaction():
@@ -81,15 +82,6 @@ def run_migrations_online():
 
     """
 
-    with connectable.connect() as connection:
-        context.configure(
-            connection=connection,
-            target_metadata=target_metadata,
-            **conf_args
-        )
-        with context.begin_transaction():
-            context.run_migrations()
-
     # this callback is used to prevent an auto-migration from being generated
     # when there are no changes to the schema
     # reference: http://alembic.zzzcomputing.com/en/latest/cookbook.html
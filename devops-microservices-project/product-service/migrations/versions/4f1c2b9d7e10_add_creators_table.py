@@ -0,0 +1,29 @@
+"""add creators table
+
+Revision ID: 4f1c2b9d7e10
+Revises: 78b40bc077d3
+Create Date: 2025-09-02 10:12:41.214530
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f1c2b9d7e10'
+down_revision = '78b40bc077d3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('creators',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=80), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+
+
+def downgrade():
+    op.drop_table('creators')
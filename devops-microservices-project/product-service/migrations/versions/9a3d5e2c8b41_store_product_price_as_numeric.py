@@ -0,0 +1,34 @@
+"""store product price as numeric
+
+Revision ID: 9a3d5e2c8b41
+Revises: 4f1c2b9d7e10
+Create Date: 2025-09-15 09:41:07.532118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a3d5e2c8b41'
+down_revision = '4f1c2b9d7e10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # rewrites the table under an exclusive lock; run it before the
+    # concurrent index builds in the next revision so they index the new type
+    op.alter_column('products', 'price',
+               existing_type=sa.Float(),
+               type_=sa.Numeric(precision=12, scale=2),
+               existing_nullable=False,
+               postgresql_using='round(price::numeric, 2)')
+
+
+def downgrade():
+    op.alter_column('products', 'price',
+               existing_type=sa.Numeric(precision=12, scale=2),
+               type_=sa.Float(),
+               existing_nullable=False,
+               postgresql_using='price::double precision')
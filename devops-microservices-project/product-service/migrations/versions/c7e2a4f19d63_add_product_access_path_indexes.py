@@ -0,0 +1,49 @@
+"""add product access path indexes
+
+Revision ID: c7e2a4f19d63
+Revises: e3a9c1d4b702
+Create Date: 2025-09-15 09:58:22.804613
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7e2a4f19d63'
+down_revision = 'e3a9c1d4b702'
+branch_labels = None
+depends_on = None
+
+INDEXES = {
+    # per-user counts and per-user keyset pages; the leading user_id also
+    # serves plain user_id lookups, so no separate single-column index
+    'ix_products_user_id_id': '(user_id, id)',
+    # price range filters and the (price, id) keyset order
+    'ix_products_price_id': '(price, id)',
+}
+
+
+def upgrade():
+    # CONCURRENTLY cannot run inside a transaction block
+    with op.get_context().autocommit_block():
+        for name, columns in INDEXES.items():
+            _drop_if_invalid(name)
+            op.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON products {columns}')
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name in INDEXES:
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+
+
+def _drop_if_invalid(name):
+    # an interrupted concurrent build leaves an INVALID index behind, which
+    # IF NOT EXISTS would otherwise mistake for a finished one
+    invalid = op.get_bind().execute(sa.text(
+        "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE c.relname = :name AND NOT i.indisvalid"
+    ), {'name': name}).first()
+    if invalid:
+        op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
@@ -0,0 +1,55 @@
+"""add product search vector
+
+Revision ID: d5b8f3a6e214
+Revises: c7e2a4f19d63
+Create Date: 2025-09-22 14:06:53.118407
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5b8f3a6e214'
+down_revision = 'c7e2a4f19d63'
+branch_labels = None
+depends_on = None
+
+INDEXES = {
+    'ix_products_search_vector': 'USING gin (search_vector)',
+    'ix_products_name_trgm': 'USING gin (name gin_trgm_ops)',
+}
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    # a stored generated column rewrites the table under an exclusive lock
+    op.add_column('products', sa.Column('search_vector', postgresql.TSVECTOR(), sa.Computed(
+        "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(description, '')), 'B')",
+        persisted=True), nullable=True))
+
+    # CONCURRENTLY cannot run inside a transaction block
+    with op.get_context().autocommit_block():
+        for name, definition in INDEXES.items():
+            _drop_if_invalid(name)
+            op.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON products {definition}')
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name in INDEXES:
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+    op.drop_column('products', 'search_vector')
+
+
+def _drop_if_invalid(name):
+    # an interrupted concurrent build leaves an INVALID index behind, which
+    # IF NOT EXISTS would otherwise mistake for a finished one
+    invalid = op.get_bind().execute(sa.text(
+        "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE c.relname = :name AND NOT i.indisvalid"
+    ), {'name': name}).first()
+    if invalid:
+        op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
@@ -0,0 +1,28 @@
+"""add products user_id
+
+Revision ID: e3a9c1d4b702
+Revises: 9a3d5e2c8b41
+Create Date: 2025-10-06 11:20:14.382615
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3a9c1d4b702'
+down_revision = '9a3d5e2c8b41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the initial migration predates products.user_id, which the model has
+    # always required; tables made by db.create_all() already have it.
+    # Existing rows can't be attributed to a user, so this fails on a
+    # non-empty table without the column rather than inventing owners.
+    op.execute('ALTER TABLE products ADD COLUMN IF NOT EXISTS user_id INTEGER NOT NULL')
+
+
+def downgrade():
+    op.drop_column('products', 'user_id')
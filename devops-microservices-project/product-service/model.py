@@ -1,15 +1,68 @@
 from flask_sqlalchemy import SQLAlchemy
+from datetime import datetime
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import deferred
 
 db = SQLAlchemy()
 
+PRICE_PRECISION = 12
+PRICE_SCALE = 2
+
+# text search configuration for the search_vector column and its queries
+SEARCH_CONFIG = 'english'
+
 class Product(db.Model):
     __tablename__ = 'products'
+    __table_args__ = (
+        # per-user counts and per-user keyset pages (leading user_id also
+        # serves plain user_id lookups)
+        db.Index('ix_products_user_id_id', 'user_id', 'id'),
+        # price range filters and the (price, id) keyset order
+        db.Index('ix_products_price_id', 'price', 'id'),
+        # full-text matches, and trigram prefix/typo matches on the name
+        db.Index('ix_products_search_vector', 'search_vector', postgresql_using='gin'),
+        db.Index('ix_products_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
-    price = db.Column(db.Float, nullable=False)
+    price = db.Column(db.Numeric(PRICE_PRECISION, PRICE_SCALE), nullable=False)
     description = db.Column(db.Text)
     user_id = db.Column(db.Integer, nullable=False)  
+    # maintained by Postgres; name outranks description. Deferred so normal
+    # product loads don't fetch it.
+    search_vector = deferred(db.Column(TSVECTOR, db.Computed(
+        f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(name, '')), 'A') || "
+        f"setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(description, '')), 'B')",
+        persisted=True)))
     
     def __repr__(self):
-        return f'<Product {self.name}>'
\ No newline at end of file
+        return f'<Product {self.name}>'
+
+def parse_price(value):
+    """Parse a request price into a Decimal at the column's scale, raising ValueError on bad input.
+
+    Bind prices as Decimal rather than float: comparing the numeric column
+    with a float parameter casts the column and skips ix_products_price_id.
+    """
+    if isinstance(value, bool):
+        raise ValueError("Invalid price")
+    try:
+        price = Decimal(str(value)).quantize(Decimal(1).scaleb(-PRICE_SCALE), ROUND_HALF_UP)
+    except (InvalidOperation, TypeError):
+        raise ValueError("Invalid price")
+    if not price.is_finite() or price.adjusted() >= PRICE_PRECISION - PRICE_SCALE:
+        raise ValueError("Invalid price")
+    return price
+
+class Creator(db.Model):
+    """Local copy of user names, fed by the user-service event stream."""
+    __tablename__ = 'creators'
+
+    user_id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(80), nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<Creator {self.name}>'
@@ -0,0 +1,135 @@
+import base64
+import hashlib
+import json
+
+from sqlalchemy import tuple_
+
+from model import Product, parse_price
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# sort option -> (column, descending)
+SORT_OPTIONS = {
+    'id': (None, False),
+    '-id': (None, True),
+    'price': (Product.price, False),
+    '-price': (Product.price, True),
+}
+
+
+class PageRequest:
+    """Validated query parameters for one keyset-paginated /products page."""
+
+    def __init__(self, limit, sort, cursor, user_id, min_price, max_price):
+        self.limit = limit
+        self.sort = sort
+        self.cursor = cursor
+        self.user_id = user_id
+        self.min_price = min_price
+        self.max_price = max_price
+
+    @classmethod
+    def from_args(cls, args):
+        """Build a PageRequest from request.args, raising ValueError on bad input."""
+        limit = args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+        if limit is None or limit < 1 or limit > MAX_PAGE_SIZE:
+            raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+
+        sort = args.get('sort', 'id')
+        if sort not in SORT_OPTIONS:
+            raise ValueError(f"sort must be one of {', '.join(SORT_OPTIONS)}")
+
+        user_id = _optional(args, 'user_id', int)
+        # Decimal bounds keep the comparison numeric = numeric, so the
+        # range can use ix_products_price_id
+        min_price = _optional(args, 'min_price', parse_price)
+        max_price = _optional(args, 'max_price', parse_price)
+
+        cursor = args.get('cursor')
+        if cursor:
+            cursor = decode_cursor(cursor, sort)
+
+        return cls(limit, sort, cursor, user_id, min_price, max_price)
+
+    def cache_key(self, generation):
+        """Per-page cache key within a list generation; identical parameters share one entry."""
+        raw = json.dumps([self.limit, self.sort, self.cursor, self.user_id, self.min_price, self.max_price], default=str)
+        return f"products:list:{generation}:" + hashlib.sha1(raw.encode()).hexdigest()
+
+    def query(self):
+        """Keyset query for this page. Fetches one extra row to detect a next page."""
+        column, descending = SORT_OPTIONS[self.sort]
+        query = Product.query
+
+        if self.user_id is not None:
+            query = query.filter(Product.user_id == self.user_id)
+        if self.min_price is not None:
+            query = query.filter(Product.price >= self.min_price)
+        if self.max_price is not None:
+            query = query.filter(Product.price <= self.max_price)
+
+        if column is None:
+            if self.cursor is not None:
+                last_id, = self.cursor
+                query = query.filter(Product.id < last_id if descending else Product.id > last_id)
+            order = [Product.id.desc() if descending else Product.id.asc()]
+        else:
+            if self.cursor is not None:
+                key = tuple_(column, Product.id)
+                query = query.filter(key < tuple(self.cursor) if descending else key > tuple(self.cursor))
+            order = [column.desc(), Product.id.desc()] if descending else [column.asc(), Product.id.asc()]
+
+        return query.order_by(*order).limit(self.limit + 1)
+
+    def next_cursor(self, last_product):
+        column, _ = SORT_OPTIONS[self.sort]
+        if column is None:
+            return encode_cursor(self.sort, [last_product.id])
+        # prices travel as strings so the Decimal survives the round trip
+        return encode_cursor(self.sort, [str(getattr(last_product, column.key)), last_product.id])
+
+
+def encode_cursor(sort, values):
+    raw = json.dumps({'s': sort, 'v': values}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def read_cursor(token, sort, expected):
+    """Return the cursor's values, checking it was issued for ``sort`` and holds ``expected`` values."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        values = payload['v']
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("Invalid cursor")
+    if payload.get('s') != sort:
+        raise ValueError("Cursor does not match sort order")
+    if not isinstance(values, list) or len(values) != expected:
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def decode_cursor(token, sort):
+    expected = 1 if SORT_OPTIONS[sort][0] is None else 2
+    values = read_cursor(token, sort, expected)
+    # the id goes straight into the query; Postgres rejects a non-integer with a 500
+    last_id = values[-1]
+    if isinstance(last_id, bool) or not isinstance(last_id, int):
+        raise ValueError("Invalid cursor")
+    if expected == 2:
+        try:
+            values[0] = parse_price(values[0])
+        except ValueError:
+            raise ValueError("Invalid cursor")
+    return values
+
+
+def _optional(args, name, type_):
+    value = args.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return type_(value)
+    except ValueError:
+        raise ValueError(f"Invalid {name}")
@@ -0,0 +1,80 @@
+import hashlib
+import json
+import re
+
+from sqlalchemy import Float, cast, func, literal, or_, tuple_
+
+from model import db, Product, SEARCH_CONFIG
+from pagination import encode_cursor, read_cursor
+
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+MAX_QUERY_LENGTH = 200
+
+# letters and digits only, so terms can be spliced into to_tsquery syntax
+TERM = re.compile(r'[^\W_]+')
+
+
+class SearchRequest:
+    """Validated query parameters for one /products/search page."""
+
+    def __init__(self, q, terms, limit, cursor):
+        self.q = q
+        self.terms = terms
+        self.limit = limit
+        self.cursor = cursor
+
+    @classmethod
+    def from_args(cls, args):
+        """Build a SearchRequest from request.args, raising ValueError on bad input."""
+        q = ' '.join(args.get('q', '').split()).lower()
+        if not q:
+            raise ValueError("q is required")
+        if len(q) > MAX_QUERY_LENGTH:
+            raise ValueError(f"q must be at most {MAX_QUERY_LENGTH} characters")
+        terms = TERM.findall(q)
+        if not terms:
+            raise ValueError("q must contain a letter or digit")
+
+        limit = args.get('limit', DEFAULT_SEARCH_LIMIT, type=int)
+        if limit is None or limit < 1 or limit > MAX_SEARCH_LIMIT:
+            raise ValueError(f"limit must be between 1 and {MAX_SEARCH_LIMIT}")
+
+        cursor = args.get('cursor')
+        if cursor:
+            cursor = read_cursor(cursor, 'rank', 2)
+            score, last_id = cursor
+            if isinstance(score, bool) or not isinstance(score, (int, float)) or isinstance(last_id, bool) or not isinstance(last_id, int):
+                raise ValueError("Invalid cursor")
+
+        return cls(q, terms, limit, cursor)
+
+    def cache_key(self, generation):
+        """Per-page cache key within a search generation; identical searches share one entry."""
+        raw = json.dumps([self.q, self.limit, self.cursor])
+        return f"products:search:{generation}:" + hashlib.sha1(raw.encode()).hexdigest()
+
+    def query(self):
+        """(id, score) rows for this page, best match first. Fetches one extra row to detect a next page.
+
+        A product matches when every term prefixes a word in its name or
+        description (GIN on search_vector), or when the query is close to a
+        word in its name (trigram word similarity, GIN on name), which
+        catches typos. The score adds ts_rank to the name similarity; both
+        are cast to double precision so the score round-trips exactly
+        through the cursor.
+        """
+        tsquery = func.to_tsquery(SEARCH_CONFIG, ' & '.join(f'{term}:*' for term in self.terms))
+        score = (cast(func.ts_rank(Product.search_vector, tsquery), Float)
+                 + cast(func.word_similarity(self.q, Product.name), Float))
+
+        query = db.session.query(Product.id, score.label('score')).filter(or_(
+            Product.search_vector.op('@@')(tsquery),
+            literal(self.q).op('<%')(Product.name),
+        ))
+        if self.cursor is not None:
+            query = query.filter(tuple_(score, Product.id) < tuple(self.cursor))
+        return query.order_by(score.desc(), Product.id.desc()).limit(self.limit + 1)
+
+    def next_cursor(self, last_row):
+        return encode_cursor('rank', [last_row.score, last_row.id])
@@ -1,215 +1,268 @@
 from flask_migrate import Migrate
 from flask import Flask, jsonify, request
 import os
-import requests
+from common import deadline
+from common.tracing import TracedRedis, Tracer, exporter_from_env, instrument_engine_tracing
+from common.log_pipeline import LogPipeline
+from common.log_sampling import RequestSummary
+from common.prometheus_multiproc import metrics_output
+from common.request_metrics import RequestMetrics, TimedRedisConnection, instrument_engine_timing
+from common.db_pool import PoolMetrics, engine_options_from_env, instrument_engine, report_pool_size
+from common.cache import CacheMetrics, TieredCache
+from common.product_counts import product_count_key
+from common.user_events import USER_CREATED, publish_user_event
 import redis
 from model import db, User
 from flask_cors import CORS
-from werkzeug.security import generate_password_hash, check_password_hash
+from last_login import LastLoginBuffer
+from passwords import RETRY_AFTER, HasherBusy, HasherMetrics, PasswordHasher
 import jwt
-import logging
-import logging.handlers
 import datetime
 import time
 from sqlalchemy.exc import OperationalError
 import json
-from prometheus_client import Counter, Histogram, Gauge, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import Counter, Gauge, CONTENT_TYPE_LATEST
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'mysecretkey')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+DB_POOL_METRICS = PoolMetrics('user_service')
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options_from_env(DB_POOL_METRICS)
 
 db.init_app(app)
 migrate = Migrate(app, db)
 CORS(app)
 
 app.app_context().push()
+instrument_engine(db.engine, DB_POOL_METRICS)
+instrument_engine_timing(db.engine)
+instrument_engine_tracing(db.engine)
 
 # Redis setup
 redis_host = os.environ.get('REDIS_HOST', 'redis')
 redis_port = int(os.environ.get('REDIS_PORT', 6379))
-redis_client = redis.Redis(host=redis_host, port=redis_port, db=0, decode_responses=True)
+# connections time their socket I/O into the current request's Redis time;
+# commands and pipelines are traced as spans
+redis_client = TracedRedis(connection_pool=redis.ConnectionPool(
+    host=redis_host, port=redis_port, db=0, decode_responses=True, connection_class=TimedRedisConnection))
+
+# Upper bound on ids accepted by /users/batch
+USER_BATCH_MAX_IDS = int(os.environ.get('USER_BATCH_MAX_IDS', 1000))
+
+# Request tracing (common/tracing.py); registered before the other request
+# hooks so everything they log carries the trace ID
+tracer = Tracer('user_service', exporter_from_env())
+tracer.init_app(app)
 
 # Prometheus metrics
-REQUEST_COUNT = Counter('user_service_requests_total', 'Total requests', ['method', 'endpoint', 'status'])
-REQUEST_DURATION = Histogram('user_service_request_duration_seconds', 'Request duration')
-ACTIVE_USERS = Gauge('user_service_active_users', 'Number of active users')
+# request count and latency per method/route/status, plus per-request
+# db, Redis and upstream time, recorded by request hooks
+REQUEST_METRICS = RequestMetrics('user_service')
+REQUEST_METRICS.init_app(app)
+# only ever incremented, so keep exited workers' share
+ACTIVE_USERS = Gauge('user_service_active_users', 'Number of active users', multiprocess_mode='sum')
 LOGIN_ATTEMPTS = Counter('user_service_login_attempts_total', 'Login attempts', ['status'])
 
+# password hashing runs in a bounded process pool, off the request threads
+password_hasher = PasswordHasher(HasherMetrics('user_service'))
+
 
 # log_dir = '/app/logs'
 # os.mkdir(log_dir)
 
-# Structured logging
-class JSONFormatter(logging.Formatter):
-    def format(self, record):
-        log_entry = {
-            '@timestamp': datetime.datetime.utcnow().isoformat() + 'Z',
-            'timestamp': datetime.datetime.utcnow().isoformat() + 'Z',
-            'level': record.levelname,
-            'service': 'user_service',
-            'message': record.getMessage(),
-            'module': record.module,
-            'function': record.funcName,
-            'line': record.lineno
-        }
-
-        if record.exc_info:
-            log_entry['exception'] = self.formatException(record.exc_info)
-            
-        # Add extra fields if present
-        if hasattr(record, 'user_id'):
-            log_entry['user_id'] = record.user_id
-        if hasattr(record, 'product_id'):
-            log_entry['product_id'] = record.product_id
-        if hasattr(record, 'user_name'):
-            log_entry['user_name'] = record.user_name
-        if hasattr(record, 'endpoint'):
-            log_entry['endpoint'] = record.endpoint
-        if hasattr(record, 'status_code'):
-            log_entry['status_code'] = record.status_code
-            
-        return json.dumps(log_entry)
-
-# Set up logging
-
-
-logger = logging.getLogger('user_service')
-logger.setLevel(logging.INFO)
-
-# Remove any existing handlers to avoid duplicates
-for handler in logger.handlers[:]:
-    logger.removeHandler(handler)
-
-# Create rotating file handler (10MB per file, keep 5 files)
-# log_file = os.path.join(log_dir, 'app.log')
-# file_handler = logging.handlers.RotatingFileHandler(
-#     log_file, 
-#     maxBytes=10*1024*1024,  # 10MB
-#     backupCount=5
-# )
-
-# Create console handler with JSON formatter
-handler = logging.StreamHandler()
-handler.setFormatter(JSONFormatter())
-logger.addHandler(handler)
+# Structured logging: JSON lines written by a background thread
+log_pipeline = LogPipeline('user_service')
+logger = log_pipeline.logger
+# per-endpoint request summaries stand in for sampled-out lines; registered
+# first so requests rejected by later hooks are still counted
+request_summary = RequestSummary(logger)
+request_summary.init_app(app)
 
 logger.info("User service started", extra={'endpoint': 'startup'})
 
+deadline.init_app(app, logger)
+
+# In-process L1 cache in front of Redis, kept coherent over pub/sub
+cache = TieredCache(redis_client, CacheMetrics('user_service'), logger)
+
+# /login buffers last_login in Redis; flushed to Postgres in batches (last_login.py)
+last_logins = LastLoginBuffer(app, redis_client, logger, cache)
+
 @app.route('/user/<int:user_id>')
 def get_user(user_id):
-    start_time = time.time()
-    logger.info(f"Get user request for user_id: {user_id}", extra={'endpoint': '/user/<int:user_id>', 'user_id': user_id})
+    logger.info("Get user request for user_id: %s", user_id, extra={'endpoint': '/user/<int:user_id>', 'user_id': user_id})
     
     try:
         cache_key = f"user:{user_id}"
-        cached_user = redis_client.get(cache_key)
-
-        if cached_user:
-            logger.info("User found in cache", extra={'endpoint': '/user/<int:user_id>', 'user_id': user_id, 'cached': True})
-            user_data = json.loads(cached_user)
-            try:
-                resp = requests.get(f'http://product_service:5002/products/count?user_id={user_id}', timeout=2)
-                if resp.status_code == 200:
-                    user_data["products_created"] = resp.json().get("count", 0)
-            except Exception as e:
-                logger.warning("Failed to fetch product count", extra={'endpoint': '/user/<int:user_id>', 'user_id': user_id, 'error': str(e)})
-                user_data["products_created"] = "unavailable"
-            
-            REQUEST_COUNT.labels('GET', '/user/<int:user_id>', '200').inc()
-            REQUEST_DURATION.observe(time.time() - start_time)
-            logger.info("User retrieved from cache", extra={'endpoint': '/user/<int:user_id>', 'user_id': user_id, 'status_code': 200})
+        count_key = product_count_key(user_id)
+        # the product counter is maintained by product-service; one MGET (or
+        # L1 hits) fetches it together with the cached user
+        cached = cache.get_many([cache_key, count_key])
+        products_count = int(cached.get(count_key) or 0)
+        cached_user = cached.get(cache_key)
+
+        if cached_user is not None:
+            # copy: the cached dict is shared with other requests
+            user_data = {**cached_user, "products_created": products_count}
+            # a login newer than the cached copy may still be buffered
+            user_data["last_login"] = last_logins.pending(user_id) or user_data.get("last_login")
+            logger.info("User retrieved from cache", extra={'endpoint': '/user/<int:user_id>', 'user_id': user_id, 'status_code': 200, 'cached': True})
             return jsonify({"user": user_data, "cached": True})
 
         user = User.query.get(user_id)
         if not user:
             logger.warning("User not found", extra={'endpoint': '/user/<int:user_id>', 'user_id': user_id, 'status_code': 404})
-            REQUEST_COUNT.labels('GET', '/user/<int:user_id>', '404').inc()
-            REQUEST_DURATION.observe(time.time() - start_time)
             return jsonify({"error": "User not found"}), 404
-        
-        try:
-            resp = requests.get(f'http://product_service:5002/products/count?user_id={user_id}', timeout=2)
-            if resp.status_code == 200:
-                products_count = resp.json().get("count", 0)
-            else:
-                products_count = "unavailable"
-        except Exception as e:
-            logger.warning("Failed to fetch product count from product service", extra={'endpoint': '/user/<int:user_id>', 'user_id': user_id, 'error': str(e)})
-            products_count = "unavailable"
 
         user_data = {
             "user_id": user.id,
             "name": user.name,
-            "last_login": user.last_login.isoformat() if user.last_login else None,
-            "products_created": products_count
+            "last_login": user.last_login.isoformat() if user.last_login else None
         }
 
-        redis_client.setex(cache_key, 120, json.dumps(user_data))
-        REQUEST_COUNT.labels('GET', '/user/<int:user_id>', '200').inc()
-        REQUEST_DURATION.observe(time.time() - start_time)
+        cache.set(cache_key, user_data, 120)
+        user_data = {**user_data, "products_created": products_count}
+        user_data["last_login"] = last_logins.pending(user_id) or user_data["last_login"]
         logger.info("User retrieved from database", extra={'endpoint': '/user/<int:user_id>', 'user_id': user_id, 'status_code': 200})
         return jsonify({"user": user_data, "cached": False})
     except Exception as e:
         logger.error("Error retrieving user", extra={'endpoint': '/user/<int:user_id>', 'user_id': user_id, 'error': str(e)})
-        REQUEST_COUNT.labels('GET', '/user/<int:user_id>', '500').inc()
-        REQUEST_DURATION.observe(time.time() - start_time)
+        return jsonify({"error": str(e)}), 500
+
+# resolve many users in one round trip (used by product-service for creator names)
+@app.route("/users/batch", methods=["POST"])
+def get_users_batch():
+    try:
+        data = request.get_json(silent=True) or {}
+        raw_ids = data.get("ids")
+        if not isinstance(raw_ids, list):
+            logger.warning("Batch user lookup missing ids", extra={'endpoint': '/users/batch', 'status_code': 400})
+            return jsonify({"error": "ids must be a list of user ids"}), 400
+
+        try:
+            user_ids = list(dict.fromkeys(int(uid) for uid in raw_ids))
+        except (TypeError, ValueError):
+            logger.warning("Batch user lookup with invalid ids", extra={'endpoint': '/users/batch', 'status_code': 400})
+            return jsonify({"error": "Invalid user id"}), 400
+
+        if len(user_ids) > USER_BATCH_MAX_IDS:
+            logger.warning("Batch user lookup too large", extra={'endpoint': '/users/batch', 'user_count': len(user_ids), 'status_code': 400})
+            return jsonify({"error": f"At most {USER_BATCH_MAX_IDS} ids per request"}), 400
+
+        users = {}
+        if user_ids:
+            # one MGET over the same user:{id} keys get_user fills
+            cached_users = redis_client.mget([f"user:{uid}" for uid in user_ids])
+            for uid, cached_user in zip(user_ids, cached_users):
+                if cached_user:
+                    user_data = json.loads(cached_user)
+                    users[uid] = {
+                        "user_id": uid,
+                        "name": user_data.get("name"),
+                        "last_login": user_data.get("last_login")
+                    }
+
+            # one IN query for everything that missed
+            missing_ids = [uid for uid in user_ids if uid not in users]
+            # read past the cache object, so report the lookups ourselves
+            cache.record_lookups(hits=[f"user:{uid}" for uid in users], misses=[f"user:{uid}" for uid in missing_ids])
+            if missing_ids:
+                pipe = redis_client.pipeline(transaction=False)
+                for user in User.query.filter(User.id.in_(missing_ids)).all():
+                    user_data = {
+                        "user_id": user.id,
+                        "name": user.name,
+                        "last_login": user.last_login.isoformat() if user.last_login else None
+                    }
+                    users[user.id] = user_data
+                    pipe.setex(f"user:{user.id}", 120, json.dumps(user_data))
+                pipe.execute()
+
+            for uid, pending in last_logins.pending_many(list(users)).items():
+                users[uid]["last_login"] = pending
+
+        not_found = [uid for uid in user_ids if uid not in users]
+        logger.info("Batch user lookup completed", extra={'endpoint': '/users/batch', 'user_count': len(users), 'status_code': 200})
+        return jsonify({"users": [users[uid] for uid in user_ids if uid in users], "not_found": not_found})
+    except Exception as e:
+        logger.error("Error in batch user lookup", extra={'endpoint': '/users/batch', 'error': str(e)})
         return jsonify({"error": str(e)}), 500
 
 @app.route("/register", methods=["POST"])
 def register():
-    start_time = time.time()
     try:
         data = request.get_json()
         logger.info("Registration attempt", extra={'endpoint': '/register', 'user_name': data.get('name') if data else None})
         
         if not data or not data.get("name") or not data.get("password"):
             logger.warning("Registration failed - missing name or password", extra={'endpoint': '/register', 'status_code': 400})
-            REQUEST_COUNT.labels('POST', '/register', '400').inc()
-            REQUEST_DURATION.observe(time.time() - start_time)
             return jsonify({"error": "Name and password are required"}), 400
 
         if User.query.filter_by(name=data["name"]).first():
             logger.warning("Registration failed - user already exists", extra={'endpoint': '/register', 'user_name': data["name"], 'status_code': 400})
-            REQUEST_COUNT.labels('POST', '/register', '400').inc()
-            REQUEST_DURATION.observe(time.time() - start_time)
             return jsonify({"error": "User already exists"}), 400
 
-        hashed_password = generate_password_hash(data["password"])
+        try:
+            hashed_password = password_hasher.hash(data["password"])
+        except HasherBusy as e:
+            logger.warning("Registration refused - password hashing saturated", extra={'endpoint': '/register', 'error': str(e), 'status_code': 503})
+            return jsonify({"error": "Service busy, retry shortly"}), 503, {'Retry-After': str(RETRY_AFTER)}
         user = User(name=data["name"], password=hashed_password)
         db.session.add(user)
         db.session.commit()
+
+        try:
+            publish_user_event(redis_client, USER_CREATED, user.id, user.name)
+        except Exception as e:
+            # product-service falls back to /users/batch for creators it hasn't seen
+            logger.warning("Failed to publish user created event", extra={'endpoint': '/register', 'user_id': user.id, 'error': str(e)})
         
         ACTIVE_USERS.inc()
-        REQUEST_COUNT.labels('POST', '/register', '201').inc()
-        REQUEST_DURATION.observe(time.time() - start_time)
         logger.info("User registered successfully", extra={'endpoint': '/register', 'user_name': data["name"], 'user_id': user.id, 'status_code': 201})
         return jsonify({"message": "User created"}), 201
     except Exception as e:
         logger.error("Registration error", extra={'endpoint': '/register', 'error': str(e)})
-        REQUEST_COUNT.labels('POST', '/register', '500').inc()
-        REQUEST_DURATION.observe(time.time() - start_time)
         return jsonify({"error": str(e)}), 500
 
 @app.route("/login", methods=["POST"])
 def login():
-    start_time = time.time()
     try:
         data = request.get_json()
         logger.info("Login attempt", extra={'endpoint': '/login', 'user_name': data.get('name') if data else None})
         
         user = User.query.filter_by(name=data.get("name")).first()
 
-        if not user or not check_password_hash(user.password, data.get("password")):
+        try:
+            valid = user is not None and password_hasher.verify(user.password, data.get("password"))
+        except HasherBusy as e:
+            LOGIN_ATTEMPTS.labels('rejected').inc()
+            logger.warning("Login refused - password hashing saturated", extra={'endpoint': '/login', 'error': str(e), 'status_code': 503})
+            return jsonify({"error": "Service busy, retry shortly"}), 503, {'Retry-After': str(RETRY_AFTER)}
+
+        if not valid:
             LOGIN_ATTEMPTS.labels('failed').inc()
-            REQUEST_COUNT.labels('POST', '/login', '401').inc()
-            REQUEST_DURATION.observe(time.time() - start_time)
             logger.warning("Invalid login credentials", extra={'endpoint': '/login', 'user_name': data.get('name'), 'status_code': 401})
             return jsonify({"error": "Invalid credentials"}), 401
 
-        user.last_login = datetime.datetime.utcnow()
-        db.session.commit()
+        # upgrade hashes made with an older method or cost while the password is at hand
+        if password_hasher.needs_rehash(user.password):
+            try:
+                user.password = password_hasher.hash(data.get("password"))
+                db.session.commit()
+                password_hasher.metrics.rehashed.inc()
+            except HasherBusy:
+                # not worth failing the login over; retried on the next one
+                pass
+
+        now = datetime.datetime.utcnow()
+        try:
+            last_logins.record(user.id, now)
+        except redis.RedisError as e:
+            # without the buffer, write it through as before
+            logger.warning("Could not buffer last_login, writing it directly", extra={'endpoint': '/login', 'user_id': user.id, 'error': str(e)})
+            user.last_login = now
+            db.session.commit()
         
         LOGIN_ATTEMPTS.labels('success').inc()
         ACTIVE_USERS.inc()
@@ -227,19 +280,13 @@ def login():
                 token = token.decode('utf-8')
         except Exception as e:
             logger.error("Token generation failed", extra={'endpoint': '/login', 'user_id': user.id, 'error': str(e)})
-            REQUEST_COUNT.labels('POST', '/login', '500').inc()
-            REQUEST_DURATION.observe(time.time() - start_time)
             return jsonify({"error": f"Token generation failed: {str(e)}"}), 500
 
-        REQUEST_COUNT.labels('POST', '/login', '200').inc()
-        REQUEST_DURATION.observe(time.time() - start_time)
         logger.info("Successful login", extra={'endpoint': '/login', 'user_id': user.id, 'user_name': user.name, 'status_code': 200})
         return jsonify({"token": token})
     except Exception as e:
         logger.error("Login error", extra={'endpoint': '/login', 'error': str(e)})
         LOGIN_ATTEMPTS.labels('failed').inc()
-        REQUEST_COUNT.labels('POST', '/login', '500').inc()
-        REQUEST_DURATION.observe(time.time() - start_time)
         return jsonify({"error": str(e)}), 500
 
 # health check
@@ -252,10 +299,11 @@ def health():
 @app.route('/metrics')
 def metrics():
     logger.info("Metrics endpoint accessed", extra={'endpoint': '/metrics'})
-    resp = generate_latest()
+    # merged across gunicorn workers in multiprocess mode
+    resp = metrics_output()
     return resp, 200, {'Content-Type': CONTENT_TYPE_LATEST}
 
-if __name__ == "__main__":
+def init_db():
     with app.app_context():
         for _ in range(10):
             try:
@@ -265,5 +313,34 @@ if __name__ == "__main__":
                 logger.warning("Database unavailable, retrying in 2 seconds...")
                 print("Database unavailable, retrying in 2 seconds...")
                 time.sleep(2)
+
+def start_background_workers():
+    request_summary.start()
+    cache.start_listener()
+    last_logins.start()
+
+# gunicorn hook (common/gunicorn_conf.py): the app is imported once in the
+# master, so connections and threads are recreated in every worker
+def post_fork():
+    # first, while the worker has no threads of its own yet
+    password_hasher.reset()
+    log_pipeline.after_fork()
+    with app.app_context():
+        db.engine.dispose(close=False)
+        report_pool_size(db.engine, DB_POOL_METRICS)
+    redis_client.connection_pool.reset()
+    start_background_workers()
+
+# gunicorn hook: flush buffered logins, log lines and traces before the worker exits
+def worker_exit():
+    request_summary.stop()
+    last_logins.stop()
+    password_hasher.shutdown()
+    tracer.close()
+    log_pipeline.stop()
+
+if __name__ == "__main__":
+    init_db()
+    start_background_workers()
     logger.info("Starting user service", extra={'port': 5001})
-    app.run(host='0.0.0.0', port=5001, debug=True)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=5001, debug=True)
@@ -0,0 +1,167 @@
+"""Write-behind buffering of users.last_login.
+
+A successful /login records its timestamp in a Redis hash instead of
+writing the users row, so logins stay off Postgres and repeated logins to
+one account collapse into a single pending value. Readers overlay the
+pending value on what Postgres has (``pending``/``pending_many``).
+
+Every LAST_LOGIN_FLUSH_INTERVAL seconds one worker, elected with a Redis
+lock, checks the buffer and flushes it with one batched
+``UPDATE ... FROM (VALUES ...)`` per LAST_LOGIN_BATCH_SIZE users. It
+flushes only once the oldest pending timestamp is LAST_LOGIN_MAX_STALENESS
+seconds old or LAST_LOGIN_MAX_PENDING users are waiting. Entries are
+removed from the hash only after the commit, and only if no newer login
+replaced them meanwhile. A worker shutting down flushes whatever is left.
+
+    LAST_LOGIN_FLUSH_INTERVAL   seconds between flush checks (default 5)
+    LAST_LOGIN_MAX_STALENESS    oldest pending timestamp age that forces a flush (default 30)
+    LAST_LOGIN_MAX_PENDING      pending users that force a flush (default 1000)
+    LAST_LOGIN_BATCH_SIZE       users per UPDATE statement (default 500)
+"""
+import datetime
+import os
+import threading
+import time
+
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy import DateTime, Integer, bindparam, column, or_, update, values
+
+from model import db, User
+
+LAST_LOGIN_FLUSH_INTERVAL = float(os.environ.get('LAST_LOGIN_FLUSH_INTERVAL', 5))
+LAST_LOGIN_MAX_STALENESS = float(os.environ.get('LAST_LOGIN_MAX_STALENESS', 30))
+LAST_LOGIN_MAX_PENDING = int(os.environ.get('LAST_LOGIN_MAX_PENDING', 1000))
+LAST_LOGIN_BATCH_SIZE = int(os.environ.get('LAST_LOGIN_BATCH_SIZE', 500))
+
+PENDING_KEY = "users:last_login:pending"
+# epoch seconds of the oldest login not yet flushed
+OLDEST_KEY = "users:last_login:oldest"
+FLUSH_LOCK = "lock:users:last_login:flush"
+
+# drop the flushed fields unless a newer login overwrote them, then move
+# the oldest marker to now if anything is still pending
+_RELEASE_FLUSHED = """
+for i = 2, #ARGV, 2 do
+    if redis.call('HGET', KEYS[1], ARGV[i]) == ARGV[i + 1] then
+        redis.call('HDEL', KEYS[1], ARGV[i])
+    end
+end
+if redis.call('HLEN', KEYS[1]) == 0 then
+    redis.call('DEL', KEYS[2])
+else
+    redis.call('SET', KEYS[2], ARGV[1])
+end
+"""
+
+FLUSHED = Counter('user_service_last_login_flushed_total', 'Buffered last_login values written to Postgres')
+FLUSH_DURATION = Histogram('user_service_last_login_flush_duration_seconds', 'Time to write one last_login batch',
+                           buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+# every worker reads the same shared hash, so take the max rather than the sum
+PENDING = Gauge('user_service_last_login_pending', 'Users with a buffered last_login', multiprocess_mode='livemax')
+
+
+def write_last_logins(rows):
+    """Set last_login from (user_id, datetime) pairs in one statement, never moving it backwards."""
+    if db.session.get_bind().dialect.name != 'postgresql':
+        # other databases (SQLite in benchmarks/) can't alias a VALUES list;
+        # one executemany of the same conditional UPDATE instead
+        db.session.execute(
+            update(User.__table__)
+            .where(User.id == bindparam('user_id'))
+            .where(or_(User.last_login.is_(None), User.last_login < bindparam('when')))
+            .values(last_login=bindparam('when')),
+            [{'user_id': user_id, 'when': when} for user_id, when in rows])
+        return
+    pending = values(column('id', Integer), column('last_login', DateTime), name='pending').data(rows)
+    db.session.execute(
+        update(User)
+        .where(User.id == pending.c.id)
+        .where(or_(User.last_login.is_(None), User.last_login < pending.c.last_login))
+        .values(last_login=pending.c.last_login)
+        .execution_options(synchronize_session=False))
+
+
+class LastLoginBuffer:
+    def __init__(self, app, redis_client, logger, cache=None):
+        self.app = app
+        self.redis = redis_client
+        self.logger = logger
+        self.cache = cache
+        self._release_flushed = redis_client.register_script(_RELEASE_FLUSHED)
+        self._thread = None
+        self._stop = threading.Event()
+
+    def record(self, user_id, when):
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hset(PENDING_KEY, user_id, when.isoformat())
+        pipe.set(OLDEST_KEY, time.time(), nx=True)
+        pipe.execute()
+
+    def pending(self, user_id):
+        """The buffered last_login for user_id as an ISO string, or None."""
+        return self.redis.hget(PENDING_KEY, user_id)
+
+    def pending_many(self, user_ids):
+        """{user_id: ISO string} for those of user_ids with a buffered last_login."""
+        if not user_ids:
+            return {}
+        return {user_id: when for user_id, when in zip(user_ids, self.redis.hmget(PENDING_KEY, user_ids)) if when}
+
+    def start(self):
+        """Start (or restart, e.g. after fork) the flush thread."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='last-login-flush', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the flush thread and write out everything still buffered."""
+        self._stop.set()
+        try:
+            self.flush()
+        except Exception as e:
+            self.logger.warning("Final last_login flush failed", extra={'endpoint': 'last_login_flush', 'error': str(e)})
+
+    def _run(self):
+        while not self._stop.wait(LAST_LOGIN_FLUSH_INTERVAL):
+            try:
+                # the lock outlives the check so only one worker flushes per interval
+                if self.redis.set(FLUSH_LOCK, os.getpid(), nx=True, px=int(LAST_LOGIN_FLUSH_INTERVAL * 1000)) and self._due():
+                    self.flush()
+            except Exception as e:
+                self.logger.warning("last_login flush failed", extra={'endpoint': 'last_login_flush', 'error': str(e)})
+
+    def _due(self):
+        count, oldest = self.redis.pipeline(transaction=False).hlen(PENDING_KEY).get(OLDEST_KEY).execute()
+        PENDING.set(count)
+        if not count:
+            return False
+        return count >= LAST_LOGIN_MAX_PENDING or oldest is None or time.time() - float(oldest) >= LAST_LOGIN_MAX_STALENESS
+
+    def flush(self):
+        """Write every buffered last_login to Postgres; return how many users were written."""
+        snapshot = self.redis.hgetall(PENDING_KEY)
+        if not snapshot:
+            return 0
+        rows = [(int(user_id), datetime.datetime.fromisoformat(when)) for user_id, when in snapshot.items()]
+
+        start = time.perf_counter()
+        with self.app.app_context():
+            try:
+                for i in range(0, len(rows), LAST_LOGIN_BATCH_SIZE):
+                    write_last_logins(rows[i:i + LAST_LOGIN_BATCH_SIZE])
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+        FLUSH_DURATION.observe(time.perf_counter() - start)
+
+        # cached users now lag Postgres; drop them before the pending values
+        # that readers overlay on them go away
+        if self.cache is not None:
+            self.cache.invalidate([f"user:{user_id}" for user_id, _ in rows])
+        args = [time.time()]
+        for user_id, when in snapshot.items():
+            args += [user_id, when]
+        self._release_flushed(keys=[PENDING_KEY, OLDEST_KEY], args=args)
+        FLUSHED.inc(len(rows))
+        return len(rows)
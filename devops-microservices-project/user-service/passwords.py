@@ -0,0 +1,144 @@
+"""Password hashing off the request threads.
+
+Hashing is deliberately CPU-heavy, so /register and /login hand it to a
+small process pool per gunicorn worker instead of running it inline:
+a login storm then queues behind the pool rather than occupying every
+request thread, and cheap endpoints like /user/<id> keep being served.
+
+Admission is bounded. When PASSWORD_HASH_MAX_PENDING jobs are already
+queued or running in this worker, new ones are refused at once with
+HasherBusy (the routes answer 503 with Retry-After) instead of piling up.
+A job that doesn't finish within PASSWORD_HASH_TIMEOUT (or the request's
+deadline) is refused the same way.
+
+    PASSWORD_HASH_METHOD        werkzeug method with its cost, e.g.
+                                pbkdf2:sha256:600000 (default) or scrypt:32768:8:1
+    PASSWORD_HASH_WORKERS       hashing processes per gunicorn worker (default 1)
+    PASSWORD_HASH_MAX_PENDING   queued + running jobs per gunicorn worker (default 4)
+    PASSWORD_HASH_TIMEOUT       seconds to wait for a result (default 5)
+
+Stored hashes made with another method or cost are re-hashed on the
+next successful login (``needs_rehash``).
+"""
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from prometheus_client import Counter, Gauge, Histogram
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from common import deadline
+
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 1))
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 4))
+PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 5))
+
+# seconds clients are told to wait after a 503
+RETRY_AFTER = 1
+
+
+class HasherBusy(Exception):
+    """Raised when a hashing job is refused or doesn't finish in time."""
+
+
+class HasherMetrics:
+    def __init__(self, prefix):
+        self.duration = Histogram(
+            f'{prefix}_password_hash_duration_seconds', 'Password hash/verify time, including time queued for the pool',
+            ['operation'], buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+        self.pending = Gauge(
+            f'{prefix}_password_hash_pending', 'Password hashing jobs queued or running',
+            multiprocess_mode='livesum')
+        self.capacity = Gauge(
+            f'{prefix}_password_hash_capacity', 'Password hashing jobs admitted at once',
+            multiprocess_mode='livesum')
+        self.rejected = Counter(
+            f'{prefix}_password_hash_rejected_total', 'Password hashing jobs refused', ['operation', 'reason'])
+        self.rehashed = Counter(
+            f'{prefix}_password_rehashed_total', 'Stored password hashes upgraded to the current method on login')
+
+
+class PasswordHasher:
+    def __init__(self, metrics, method=PASSWORD_HASH_METHOD, workers=PASSWORD_HASH_WORKERS,
+                 max_pending=PASSWORD_HASH_MAX_PENDING, timeout=PASSWORD_HASH_TIMEOUT):
+        self.metrics = metrics
+        self.method = method
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        # the method as werkzeug writes it into hashes, costs included: a
+        # valid PASSWORD_HASH_METHOD such as 'pbkdf2' or 'scrypt' omits them
+        self.hash_prefix = generate_password_hash('', method).split('$', 1)[0]
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def hash(self, password):
+        return self._run('hash', generate_password_hash, password, self.method)
+
+    def verify(self, stored_hash, password):
+        return self._run('verify', check_password_hash, stored_hash, password)
+
+    def needs_rehash(self, stored_hash):
+        """True when stored_hash was made with a different method or cost than the current one."""
+        return stored_hash.split('$', 1)[0] != self.hash_prefix
+
+    def _executor(self):
+        # per process: gunicorn workers start theirs in post_fork, before
+        # their threads, so the pool's children are forked single-threaded
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('fork'))
+                # a fork-context pool starts all of its processes on the first submit
+                self._pool.submit(int).result()
+                self.metrics.capacity.set(self.max_pending)
+            return self._pool
+
+    def _run(self, operation, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            self.metrics.rejected.labels(operation, 'queue_full').inc()
+            raise HasherBusy("Password hashing queue is full")
+
+        start = time.perf_counter()
+        self.metrics.pending.inc()
+        try:
+            future = self._executor().submit(fn, *args)
+        except Exception:
+            self._release()
+            raise
+        # the slot stays taken until the job really ends, even if we stop waiting
+        future.add_done_callback(lambda _: self._release())
+
+        timeout = self.timeout
+        remaining = deadline.remaining()
+        if remaining is not None:
+            timeout = max(0.0, min(timeout, remaining))
+        try:
+            result = future.result(timeout)
+        except FutureTimeout:
+            future.cancel()
+            self.metrics.rejected.labels(operation, 'timeout').inc()
+            raise HasherBusy("Password hashing timed out")
+        self.metrics.duration.labels(operation).observe(time.perf_counter() - start)
+        return result
+
+    def _release(self):
+        self.metrics.pending.dec()
+        self._slots.release()
+
+    def reset(self):
+        """Replace the pool state inherited across a fork and start this worker's pool."""
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._executor()
+
+    def shutdown(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None